@@ -3,9 +3,17 @@ from utils import geo_utils
 from utils import clustering_dbscan
 from utils import store_results
 from utils import data_import 
+from utils import quarter_tensor
 from functools import reduce
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import util
+from bson.binary import Binary
 import similarity
 import pandas as pd
+import numpy as np
+
+# Quarter of each day clustering worker process, set once by init_day_worker.
+_worker_quarter = None
 
 
 def import_table(mongo_client, import_database: str, collection: str, 
@@ -77,12 +85,13 @@ def import_collections(mongo_client, import_database: str, collections: dict, ye
 
 
 def cluster_collections(oneday_table: pd.DataFrame, collections_features: dict, date: str, 
-                        eps: float, min_samples: int):
+                        eps: float, min_samples: int, tensor=None, day=None, day_models=None):
     """
     For each collection:
-        -Fit DBSCan model standard scaler + model fit;
+        -Fit DBSCan model standard scaler + model fit, on the columns of the day in tensor if given;
         -Add collection group column for reference;
         -Store model as pickle file.
+    Collections with a model in day_models are not fitted, they take the labels of that model and store it.
 
     Parameters
     ----------
@@ -91,19 +100,28 @@ def cluster_collections(oneday_table: pd.DataFrame, collections_features: dict,
     from dataframe to be standardized;
     date: oneday_table date;
     eps: Epsilon parameter DBSCAN;
-    min_samples: Minimum sample parameter DBSCAN.
+    min_samples: Minimum sample parameter DBSCAN;
+    tensor: quarter_tensor.QuarterTensor of the quarter, None to scale oneday_table;
+    day: Index of the date in tensor;
+    day_models: Dictionary with DBSCAN models of the day already known per collection, e.g. from the grid search.
     
     Returns
     ----------
     oneday_labeled: Single day Dataframe with DBSCAN clustering labels.
     """
+    day_models = day_models or {}
     labeled_list = []
     for collection, features in collections_features.items():
-        labeled, dbscan_model_ = clustering_dbscan.dbscan(oneday_table, features, eps, min_samples)
+        if collection in day_models:
+            dbscan_model_ = day_models[collection]
+            labeled = oneday_table.assign(dbscan=dbscan_model_.labels_)
+        else:
+            scaled = tensor.day(day, features) if tensor is not None else None
+            labeled, dbscan_model_ = clustering_dbscan.dbscan(oneday_table, features, eps, min_samples, scaled)
+        store_results.save_pkl(dbscan_model_, date, collection)
         labeled = labeled[['COMUNE', 'dbscan']]
         labeled['collection'] = collection
         labeled_list.append(labeled)
-        store_results.save_pkl(dbscan_model_, date, collection)
     oneday_labeled = pd.concat(labeled_list)
     return oneday_labeled
 
@@ -120,12 +138,77 @@ def combine_keys_and_values(collections_features: dict):
     return collections_features
 
 
-def cluster_quarter(collections_table: pd.DataFrame, collections_features: dict, eps: float, min_samples: int):
+def init_day_worker(collections_table: pd.DataFrame, collections_features: dict, eps: float, min_samples: int,
+                    tensor):
+    """
+    Day clustering worker process initializer: keep the quarter Dataframe, the hyperparameters
+    and the quarter tensor, whose values are mapped from shared memory, once per worker.
+    The shared memory handle is closed when the worker exits.
+    """
+    global _worker_quarter
+    _worker_quarter = (collections_table, collections_features, eps, min_samples, tensor)
+    util.Finalize(tensor, tensor.detach, exitpriority=0)
+
+
+def worker_cluster_day(day: int, day_models=None):
+    """
+    DBSCAN clusters of one date of the worker process quarter, as cluster_collections.
+    """
+    collections_table, collections_features, eps, min_samples, tensor = _worker_quarter
+    oneday_table = tensor.day_table(collections_table, day)
+    return cluster_collections(oneday_table, collections_features, tensor.dates[day], eps, min_samples,
+                               tensor, day, day_models)
+
+
+def cluster_days(collections_table: pd.DataFrame, collections_features: dict, eps: float, min_samples: int,
+                 tensor, quarter_models: list, n_jobs=1):
+    """
+    DBSCAN clusters of every date of the quarter, yielded in date order.
+    With n_jobs > 1 the dates are split among worker processes, the tensor values are shared
+    through shared memory and the quarter Dataframe is sent to each worker only once.
+
+    Parameters
+    ----------
+    collections_table: Quarter Dataframe with parameter values per city and date for all collections;
+    collections_features: Dictionary with available collections and columns names (features);
+    eps: Epsilon parameter DBSCAN;
+    min_samples: Minimum sample parameter DBSCAN;
+    tensor: quarter_tensor.QuarterTensor of collections_table;
+    quarter_models: Models already known per date, cluster_collections day_models;
+    n_jobs: Number of worker processes.
+
+    Returns
+    ----------
+    oneday_labeled: Generator of single day Dataframes with DBSCAN clustering labels.
+    """
+    n_dates = len(tensor.dates)
+    if n_jobs == 1:
+        for day, date in enumerate(tensor.dates):
+            oneday_table = tensor.day_table(collections_table, day)
+            yield cluster_collections(oneday_table, collections_features, date, eps, min_samples,
+                                      tensor, day, quarter_models[day])
+        return
+    tensor.share()
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_day_worker,
+                                 initargs=(collections_table, collections_features, eps, min_samples,
+                                           tensor)) as executor:
+            # Single day DBSCAN fits are short, chunks of days save round trips to the workers.
+            chunksize = max(1, n_dates // (4 * n_jobs))
+            yield from executor.map(worker_cluster_day, range(n_dates), quarter_models, chunksize=chunksize)
+    finally:
+        tensor.unshare()
+
+
+def cluster_quarter(collections_table: pd.DataFrame, collections_features: dict, eps: float, min_samples: int,
+                    accumulator=None, keep_labels=True, tensor=None, grid_models=None, n_jobs=1):
     """
     -Update collections_features with combination of avaliable collections field;
+    -Standardize the features of every date in the quarter at once, unless tensor is given;
     -List all dates in quarter;
     -For each date in the quarter:
         Get single day Dataframe with DBSCAN clustering labels.
+        Feed the single day labels to the similarity accumulator, if any.
         Append labeled single day Dataframe to quarter labeled dataframe.
         
     Parameters
@@ -134,7 +217,13 @@ def cluster_quarter(collections_table: pd.DataFrame, collections_features: dict,
     collections_features: Dictionary with available collections and columns names (features)
     from dataframe to be standardized;
     eps: Epsilon parameter DBSCAN;
-    min_samples: Minimum sample parameter DBSCAN.
+    min_samples: Minimum sample parameter DBSCAN;
+    accumulator: similarity.CoAssociationAccumulator updated as each day is clustered;
+    keep_labels: If False the labeled days are not kept and quarter_labeled is None;
+    tensor: quarter_tensor.QuarterTensor of collections_table with the features of all collections;
+    grid_models: Models retained by grid_search_dbscan.best_hyperparameters, {(eps, min_samples): [models per date]},
+    the combination of all collections takes those models for the same hyperparameters instead of being fitted;
+    n_jobs: Number of worker processes clustering the dates, see cluster_days.
     
     Returns
     ----------   
@@ -143,21 +232,32 @@ def cluster_quarter(collections_table: pd.DataFrame, collections_features: dict,
     n_dates: lenth of the quarter in days.
     """
     collections_features = combine_keys_and_values(collections_features)
-    date_list = list(collections_table.data.unique())
+    if tensor is None:
+        tensor = quarter_tensor.QuarterTensor(collections_table, quarter_tensor.features_union(collections_features))
+    date_list = tensor.dates
     n_dates = len(date_list)
+    combined_models = (grid_models or {}).get((eps, min_samples))
+    combined_collection = list(collections_features)[-1]
+    quarter_models = [{combined_collection: combined_models[day]} if combined_models is not None else None
+                      for day in range(n_dates)]
     oneday_list = []
-    for date in date_list:
-        oneday_table = collections_table[collections_table.data == date]
-        oneday_labeled = cluster_collections(oneday_table, collections_features, date, eps, min_samples)
-        oneday_labeled.rename(columns={'dbscan': date}, inplace=True)
-        oneday_list.append(oneday_labeled)
+    for date, oneday_labeled in zip(date_list, cluster_days(collections_table, collections_features, eps,
+                                                            min_samples, tensor, quarter_models, n_jobs)):
+        if accumulator is not None:
+            accumulator.add_day(oneday_labeled, 'dbscan')
+        if keep_labels:
+            oneday_labeled.rename(columns={'dbscan': date}, inplace=True)
+            oneday_list.append(oneday_labeled)
+    if not keep_labels:
+        return None, n_dates, date_list
     quarter_labeled = reduce(lambda left, right: pd.merge(left, right, on=['COMUNE', 'collection'], how='outer'),
                              oneday_list)
     quarter_labeled = quarter_labeled.set_index(['COMUNE', 'collection']).reset_index() 
     return quarter_labeled, n_dates, date_list
 
 
-def frequency_collection(collection_labeled: pd.DataFrame, n_dates: int):
+def frequency_collection(collection_labeled: pd.DataFrame, n_dates: int, mode='dense', min_count=0,
+                         memory_budget=2 ** 28):
     """
     Calculate the similarity of each city and every other city in the dataset
     by the frequency (days) each city pair is classified in the same cluster
@@ -167,49 +267,247 @@ def frequency_collection(collection_labeled: pd.DataFrame, n_dates: int):
     ----------
     collection_labeled: Quarter Dataframe with DBSCAN clustering labels per day for one collection;
     n_dates: lenth of the quarter in days;
+    mode: {'dense': condensed counts for every city pair,
+           'sparse': sparse counts of the city pairs sharing a cluster, for large sets of cities,
+           'blocked': counts computed by blocks of reference cities into a memory-mapped matrix};
+    min_count: sparse mode only, city pairs classified in the same cluster on fewer days are dropped;
+    memory_budget: blocked mode only, working memory in bytes for the similarity computation.
     
     Returns
     ----------
-    collection_freq: Frequency Dataframe per quarter for one collection.
+    collection_similarity: City pair similarity per quarter for one collection.
     """
+    assert mode in ['dense', 'sparse', 'blocked'], f"{mode} is not a valid similarity mode."
     collection_labeled = collection_labeled.reset_index(drop=True)
-    cities = list(collection_labeled.COMUNE.unique())
-    similarity_dict = similarity.similar_cities_dict(collection_labeled)
-    collection_freq = similarity.cities_similarity_df(cities, similarity_dict, n_dates)
-    return collection_freq
+    if mode == 'sparse':
+        collection_similarity = similarity.similar_cities_sparse(collection_labeled, n_dates, min_count)
+    elif mode == 'blocked':
+        collection_similarity = similarity.similar_cities_blocked(collection_labeled, n_dates, memory_budget)
+    else:
+        collection_similarity = similarity.similar_cities_condensed(collection_labeled, n_dates)
+    return collection_similarity
 
 
-def frequency_to_dict(collection_freq, col: str, q: str, year: str):
+def frequency_to_dict_chunks(collection_similarity, col: str, q: str, year: str, memory_budget=2 ** 28):
     """
+    For each chunk of reference cities of the similarity, sized to build the records within memory_budget bytes:
+    -Expand similarity to a Frequency Dataframe;
     -Add reference columns;
     -Convert DataFrame to dictionary organized as records.
     
     Parameters
     ----------
-    collection_freq: Frequency Dataframe per quarter for one collection.
+    collection_similarity: City pair similarity per quarter for one collection.
     col: Collection name;
     q: Quarter code;
-    year: Year as string.
+    year: Year as string;
+    memory_budget: Working memory in bytes for the records of a chunk, see similarity.record_chunk_rows.
 
     Returns
     ----------
-    frequency_dict: Frequency dictionary per quarter for one collection.
+    frequency_dict: Generator of frequency dictionaries per quarter for one collection.
+    """
+    for collection_freq in collection_similarity.iter_frames(similarity.record_chunk_rows(memory_budget)):
+        if collection_freq.empty:
+            continue
+        collection_freq['ref_collection'] = col
+        collection_freq['ref_quarter'] = q
+        collection_freq['ref_year'] = year
+        collection_freq['_id'] = collection_freq[['city', 'ref_collection', 'ref_quarter',
+                                                  'ref_year']].agg('_'.join, axis=1)
+        collection_freq = collection_freq.drop('city', axis=1)
+        yield collection_freq.to_dict('records')
+
+
+def frequency_to_dict(collection_similarity, col: str, q: str, year: str):
+    """
+    Frequency dictionary per quarter for one collection, all chunks together.
     """
-    collection_freq['ref_collection'] = col
-    collection_freq['ref_quarter'] = q
-    collection_freq['ref_year'] = year
-    collection_freq['_id'] = collection_freq[['city', 'ref_collection', 'ref_quarter',
-                                              'ref_year']].agg('_'.join, axis=1)
-    collection_freq = collection_freq.drop('city', axis=1)
-    frequency_dict = collection_freq.to_dict('records')
+    frequency_dict = [record for chunk in frequency_to_dict_chunks(collection_similarity, col, q, year)
+                      for record in chunk]
     return frequency_dict
 
 
-def frequency_quarter(insert_collection, quarter_labeled: pd.DataFrame, n_dates: int, q: str, year: str):
+def neighbours_to_dict(collection_similarity, col: str, q: str, year: str, k: int):
+    """
+    -Rank the k most similar cities of each city;
+    -Convert to one dictionary per reference city with the ranked neighbours list.
+    
+    Parameters
+    ----------
+    collection_similarity: City pair similarity per quarter for one collection.
+    col: Collection name;
+    q: Quarter code;
+    year: Year as string;
+    k: Number of most similar cities per city.
+
+    Returns
+    ----------
+    neighbours_dict: Top k most similar cities dictionary per quarter for one collection.
+    """
+    neighbours, counts = similarity.top_k_neighbours(collection_similarity, k)
+    perc_sim = np.round((counts / collection_similarity.n_dates) * 100, 2)
+    names = [city.replace(' ', '_') for city in collection_similarity.cities]
+    neighbours_dict = []
+    for i, ref_city in enumerate(names):
+        neighbours_dict.append({'_id': '_'.join([ref_city, col, q, year]),
+                                'ref_COMUNE': ref_city,
+                                'ref_collection': col,
+                                'ref_quarter': q,
+                                'ref_year': year,
+                                'neighbours': [{'COMUNE': names[j], 'perc_sim': float(p)}
+                                               for j, p in zip(neighbours[i], perc_sim[i])]})
+    return neighbours_dict
+
+
+def packed_to_dict(collection_similarity, col: str, q: str, year: str):
+    """
+    Pack the similarity of one collection per quarter to a single dictionary:
+    -City index list;
+    -Condensed upper triangle counts as little-endian uint8 (or uint16) BSON Binary;
+    -Number of days, perc_sim = round(counts / n_dates * 100, 2).
+    
+    Parameters
+    ----------
+    collection_similarity: City pair similarity per quarter for one collection.
+    col: Collection name;
+    q: Quarter code;
+    year: Year as string.
+
+    Returns
+    ----------
+    packed_dict: Packed similarity dictionary per quarter for one collection.
+    """
+    condensed = collection_similarity.to_condensed()
+    dtype = '<u1' if condensed.max(initial=0) <= np.iinfo(np.uint8).max else '<u2'
+    packed_dict = {'_id': '_'.join([col, q, year]),
+                   'ref_collection': col,
+                   'ref_quarter': q,
+                   'ref_year': year,
+                   'cities': [city.replace(' ', '_') for city in collection_similarity.cities],
+                   'n_dates': int(collection_similarity.n_dates),
+                   'dtype': dtype,
+                   'counts': Binary(condensed.astype(dtype).tobytes())}
+    return packed_dict
+
+
+def collection_documents(collection_similarity, col: str, q: str, year: str, counts_directory=None,
+                         neighbours=False, k=10, storage='records', memory_budget=2 ** 28):
+    """
+    -Save the count matrix for rollups, if counts_directory is given;
+    -Build the frequency dictionary chunks (storage='records') or the single packed similarity
+    dictionary (storage='packed');
+    -Build the top k most similar cities dictionary, if neighbours is True.
+    
+    Returns
+    ----------
+    frequency_chunks: Generator (records) or list (packed) of frequency dictionaries to insert;
+    neighbours_dict: Top k most similar cities dictionary, None when neighbours is False.
+    """
+    assert storage in ['records', 'packed'], f"{storage} is not a valid storage format."
+    if counts_directory is not None:
+        similarity.save_counts(counts_directory, collection_similarity, col, q, year)
+    if storage == 'packed':
+        frequency_chunks = [[packed_to_dict(collection_similarity, col, q, year)]]
+    else:
+        frequency_chunks = frequency_to_dict_chunks(collection_similarity, col, q, year, memory_budget)
+    neighbours_dict = neighbours_to_dict(collection_similarity, col, q, year, k) if neighbours else None
+    return frequency_chunks, neighbours_dict
+
+
+def insert_documents(insert_collection, frequency_chunks, neighbours_collection=None, neighbours_dict=None):
+    """
+    Insert to MongoDB the frequency dictionary chunk by chunk and the top k most similar
+    cities dictionary, if neighbours_collection is given.
+    
+    Returns
+    ----------
+    ack: 1 if all inserts succeeded, else 0.
+    """
+    ack = 1
+    for frequency_dict in frequency_chunks:
+        ack = ack * database_utils.try_mongo_insert(frequency_dict, insert_collection)
+    if neighbours_collection is not None:
+        ack = ack * database_utils.try_mongo_insert(neighbours_dict, neighbours_collection)
+    return ack
+
+
+def upload_collection(insert_collection, collection_similarity, col: str, q: str, year: str, counts_directory=None,
+                      neighbours_collection=None, k=10, storage='records', memory_budget=2 ** 28):
+    """
+    -Save the count matrix for rollups, if counts_directory is given;
+    -Insert to MongoDB the frequency dictionary chunk by chunk, built within memory_budget bytes (storage='records')
+    or the single packed similarity dictionary (storage='packed');
+    -Insert the top k most similar cities dictionary to MongoDB, if neighbours_collection is given.
+    
+    Returns
+    ----------
+    ack: 1 if all inserts succeeded, else 0.
+    """
+    frequency_chunks, neighbours_dict = collection_documents(collection_similarity, col, q, year, counts_directory,
+                                                             neighbours_collection is not None, k, storage,
+                                                             memory_budget)
+    return insert_documents(insert_collection, frequency_chunks, neighbours_collection, neighbours_dict)
+
+
+def worker_collection_similarity(collection_labeled: pd.DataFrame, n_dates: int, mode: str, min_count: int,
+                                 memory_budget: int, col: str, q: str, year: str, counts_directory, neighbours: bool,
+                                 k: int):
+    """
+    Worker process task of one collection: similarity, counts file and top k most similar cities dictionary
+    of collection_documents. The similarity counts are sent back to build the frequency dictionaries.
+    """
+    collection_similarity = frequency_collection(collection_labeled, n_dates, mode, min_count, memory_budget)
+    if counts_directory is not None:
+        similarity.save_counts(counts_directory, collection_similarity, col, q, year)
+    neighbours_dict = neighbours_to_dict(collection_similarity, col, q, year, k) if neighbours else None
+    return collection_similarity, neighbours_dict
+
+
+def thread_insert_collection(insert_collection, collection_similarity, col: str, q: str, year: str,
+                             neighbours_collection=None, neighbours_dict=None, storage='records',
+                             memory_budget=2 ** 28):
+    """
+    Thread task of one collection: build the frequency dictionary chunks within memory_budget bytes
+    and insert them to MongoDB with the top k most similar cities dictionary, as upload_collection.
+    """
+    frequency_chunks, _ = collection_documents(collection_similarity, col, q, year, storage=storage,
+                                               memory_budget=memory_budget)
+    return insert_documents(insert_collection, frequency_chunks, neighbours_collection, neighbours_dict)
+
+
+def collection_similarities(quarter_labeled: pd.DataFrame, n_dates: int, mode='dense', min_count=0,
+                            memory_budget=2 ** 28):
+    """
+    Calculate the similarity of each collection group, in collection order.
+    
+    Parameters
+    ----------
+    quarter_labeled: Quarter Dataframe with DBSCAN clustering labels per day for all collections;
+    n_dates: length of the quarter in days;
+    mode: similarity mode, 'dense', 'sparse' or 'blocked', see frequency_collection;
+    min_count: sparse mode only, city pairs classified in the same cluster on fewer days are dropped;
+    memory_budget: blocked mode only, working memory in bytes for the similarity computation.
+    
+    Returns
+    ----------
+    Generator of (collection name, collection_similarity).
+    """
+    for col in quarter_labeled.collection.unique():
+        yield col, frequency_collection(quarter_labeled[quarter_labeled.collection == col], n_dates, mode,
+                                        min_count, memory_budget)
+
+
+def frequency_quarter(insert_collection, quarter_labeled: pd.DataFrame, n_dates: int, q: str, year: str,
+                      mode='dense', min_count=0, counts_directory=None, neighbours_collection=None, k=10,
+                      memory_budget=2 ** 28, n_jobs=1, storage='records'):
     """
     For each collection group calculate the similarity of each city and every
     other city in the dataset by the frequency (days) each city pair is
     classified in the same cluster in a quarter.
+    With n_jobs > 1 each collection similarity, counts file and top k most similar cities are computed
+    in a worker process, then its frequency dictionaries are built chunk by chunk and inserted to MongoDB
+    in a thread of its own as soon as the similarity is ready, so the collections overlap.
     
     Parameters
     ----------
@@ -217,20 +515,77 @@ def frequency_quarter(insert_collection, quarter_labeled: pd.DataFrame, n_dates:
     quarter_labeled: Quarter Dataframe with DBSCAN clustering labels per day for all collections;
     n_dates: length of the quarter in days;
     q: quarter code to query from ['q1', 'q2', 'q3', 'q4'];
-    year: period of time to query.
-
+    year: period of time to query;
+    mode: similarity mode, 'dense', 'sparse' or 'blocked', see frequency_collection;
+    min_count: sparse mode only, city pairs classified in the same cluster on fewer days are dropped;
+    counts_directory: Directory where the quarterly count matrices are saved for rollups, None to skip;
+    neighbours_collection: Destination top k most similar cities collection MongoDB, None to skip;
+    k: Number of most similar cities stored per city;
+    memory_budget: Working memory in bytes for the frequency records built at once and, blocked mode,
+    for the similarity computation;
+    n_jobs: Number of worker processes computing the collections similarity concurrently;
+    storage: 'records' one document per city pair, 'packed' one document per collection, see packed_to_dict.
     
     Returns
     ----------
     quarter_list: binary list with success inserts to MongoDB, (0=failure, 1=success).
     """
+    assert storage in ['records', 'packed'], f"{storage} is not a valid storage format."
+    assert n_jobs == 1 or mode != 'blocked', 'Blocked similarity mode runs in a single process.'
     year = str(year)
+    if n_jobs == 1:
+        quarter_list = []
+        for col, collection_similarity in collection_similarities(quarter_labeled, n_dates, mode, min_count,
+                                                                  memory_budget):
+            ack = upload_collection(insert_collection, collection_similarity, col, q, year, counts_directory,
+                                    neighbours_collection, k, storage, memory_budget)
+            quarter_list.append(ack)
+        return quarter_list
     cols = list(quarter_labeled.collection.unique())
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(cols))) as processes, \
+            ThreadPoolExecutor(max_workers=len(cols)) as threads:
+        similarities = {processes.submit(worker_collection_similarity,
+                                         quarter_labeled[quarter_labeled.collection == col], n_dates, mode, min_count,
+                                         memory_budget, col, q, year, counts_directory,
+                                         neighbours_collection is not None, k): col for col in cols}
+        uploads = {}
+        for future in as_completed(similarities):
+            collection_similarity, neighbours_dict = future.result()
+            col = similarities[future]
+            # MongoClient is thread-safe, the inserts of every thread share its connection pool.
+            uploads[col] = threads.submit(thread_insert_collection, insert_collection, collection_similarity, col, q,
+                                          year, neighbours_collection, neighbours_dict, storage, memory_budget)
+        quarter_list = [uploads[col].result() for col in cols]
+    return quarter_list
+
+
+def frequency_accumulated(insert_collection, accumulator, q: str, year: str, counts_directory=None,
+                          neighbours_collection=None, k=10, storage='records', memory_budget=2 ** 28):
+    """
+    For each collection group upload the similarity of each city and every
+    other city in the dataset counted by the accumulator while clustering the quarter.
+    
+    Parameters
+    ----------
+    insert_collection: Destination frequency season collection MongoDB;
+    accumulator: similarity.CoAssociationAccumulator fed by cluster_quarter;
+    q: quarter code to query from ['q1', 'q2', 'q3', 'q4'];
+    year: period of time to query;
+    counts_directory: Directory where the quarterly count matrices are saved for rollups, None to skip;
+    neighbours_collection: Destination top k most similar cities collection MongoDB, None to skip;
+    k: Number of most similar cities stored per city;
+    storage: 'records' one document per city pair, 'packed' one document per collection, see packed_to_dict;
+    memory_budget: Working memory in bytes for the frequency records built at once.
+    
+    Returns
+    ----------
+    quarter_list: binary list with success inserts to MongoDB, (0=failure, 1=success).
+    """
+    year = str(year)
     quarter_list = []
-    for col in cols:
-        collection_labeled = quarter_labeled[quarter_labeled.collection == col]
-        collection_freq = frequency_collection(collection_labeled, n_dates)
-        frequency_dict = frequency_to_dict(collection_freq, col, q, year)
-        ack = database_utils.try_mongo_insert(frequency_dict, insert_collection)
+    for col in accumulator.counts:
+        collection_similarity = accumulator.similarity(col)
+        ack = upload_collection(insert_collection, collection_similarity, col, q, year, counts_directory,
+                                neighbours_collection, k, storage, memory_budget)
         quarter_list.append(ack)
     return quarter_list
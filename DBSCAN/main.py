@@ -1,14 +1,21 @@
 from utils import store_results
 from utils import grid_search_dbscan
+from utils import quarter_tensor
 import execute
+import similarity
+import rollup
 
 
-def frequency_by_quarter_calculator(import_client, cluster_client, frequency_client, years):
+def frequency_by_quarter_calculator(import_client, cluster_client, frequency_client, years, streaming=False,
+                                    counts_directory=None, neighbours_client=None, n_jobs=1, storage='records',
+                                    search='grid', search_cache=None, warm_seed='quarter', search_stats=None):
     """
     -Import data from Mongo DB collection;
     -Convert latitude and longitude coordinates to cities;
+    -Standardize the features of each day of the quarter once, shared by the grid search and the clustering;
     -Grid search and select best Hyperparameters combination for DBSCAN clustering for each quarter;
-    -Fit DBSCAN model for the best Hyperparameters combination for each day;
+    -Fit DBSCAN model for the best Hyperparameters combination for each day, reusing the grid search models
+    of the combination of all collections;
     -Store model as pickle file;
     -Save DBSCAN labels to MongoDB;
     -Calculate the similarity of each city and every other city in the dataset, by the percentual of days in a quarter 
@@ -20,7 +27,18 @@ def frequency_by_quarter_calculator(import_client, cluster_client, frequency_cli
     import_client: MongoDB client credentials for input;
     cluster_client: MongoDB database and collection address for DBSCAN labels output;
     frequency_client: MongoDB database and collection address for DBSCAN percentual results output;
-    years: list of years integers.
+    years: list of years integers;
+    streaming: Count the city pair similarity day by day while clustering the quarter;
+    counts_directory: Directory where the quarterly count matrices are saved for rollups, None to skip;
+    neighbours_client: MongoDB database and collection address for the top k most similar cities, None to skip;
+    n_jobs: Number of worker processes;
+    storage: Frequency documents format, 'records' one per city pair or 'packed' one per collection;
+    search: Hyperparameters search strategy of grid_search_dbscan.best_hyperparameters;
+    search_cache: Directory of the hyperparameters searches cache, None to skip;
+    warm_seed: 'warm' search only, seed from the best hyperparameters of the previous 'quarter' or of the
+    same quarter of the previous 'year' (previous quarter when not available);
+    search_stats: Dictionary filled with the hyperparameters search statistics of every (year, quarter),
+    as grid_search_dbscan.best_hyperparameters search_stats, None to skip.
     
     Returns
     ----------
@@ -30,15 +48,39 @@ def frequency_by_quarter_calculator(import_client, cluster_client, frequency_cli
     collections = {'atmosphere_data': False, 'climate_data': True}
     quarters = ['q1', 'q2', 'q3', 'q4']
     upload_success_count = []
+    quarters_hp = {}
+    previous_hp = None
     for year in years:
         for quarter in quarters:
             collections_table, collections_features = execute.import_collections(import_client, import_database,
                                                                                  collections, year, quarter)
-            eps, min_samples = grid_search_dbscan.best_hyperparameters(collections_table, collections_features)
+            seed = quarters_hp.get((year - 1, quarter), previous_hp) if warm_seed == 'year' else previous_hp
+            tensor = quarter_tensor.QuarterTensor(collections_table,
+                                                  quarter_tensor.features_union(collections_features))
+            grid_models = {}
+            quarter_stats = {}
+            eps, min_samples = grid_search_dbscan.best_hyperparameters(collections_table, collections_features,
+                                                                       n_jobs=n_jobs, strategy=search, tensor=tensor,
+                                                                       cache_directory=search_cache, seed=seed,
+                                                                       grid_models=grid_models,
+                                                                       search_stats=quarter_stats)
+            if search_stats is not None:
+                search_stats[(year, quarter)] = quarter_stats
+            quarters_hp[(year, quarter)] = previous_hp = (eps, min_samples)
+            accumulator = similarity.CoAssociationAccumulator(collections_table.COMUNE.unique()) if streaming else None
             quarter_labeled, n_dates, date_list = execute.cluster_quarter(collections_table, collections_features,
-                                                                          eps, min_samples)
+                                                                          eps, min_samples, accumulator,
+                                                                          tensor=tensor, grid_models=grid_models,
+                                                                          n_jobs=n_jobs)
             store_results.save_db(cluster_client, quarter_labeled, date_list)
-            quarter_list = execute.frequency_quarter(frequency_client, quarter_labeled, n_dates, quarter, year)
+            if streaming:
+                quarter_list = execute.frequency_accumulated(frequency_client, accumulator, quarter, year,
+                                                             counts_directory, neighbours_client, storage=storage)
+            else:
+                quarter_list = execute.frequency_quarter(frequency_client, quarter_labeled, n_dates, quarter, year,
+                                                         counts_directory=counts_directory,
+                                                         neighbours_collection=neighbours_client, n_jobs=n_jobs,
+                                                         storage=storage)
             upload_success_count.append(quarter_list)
             
     if len(upload_success_count) == sum(upload_success_count):
@@ -46,3 +88,31 @@ def frequency_by_quarter_calculator(import_client, cluster_client, frequency_cli
     else:
         result = 'Check for frequency upload errors'
     return result
+
+
+def frequency_rollup_calculator(frequency_client, counts_directory, periods,
+                                cols=('atmosphere_data', 'climate_data', 'atmosphere_data_climate_data')):
+    """
+    -Load the saved quarterly count matrices of the periods;
+    -Sum the count matrices and number of days;
+    -Save DBSCAN percentual results of the whole set of periods to MongoDB.
+    No data import and no clustering: years, multi-years and season ranges
+    are rolled up from the quarters saved by frequency_by_quarter_calculator.
+    
+    Parameters
+    ----------
+    frequency_client: MongoDB database and collection address for DBSCAN percentual results output;
+    counts_directory: Directory of the saved quarterly count matrices;
+    periods: List of (year, quarter code) tuples, e.g. [(2021, 'q1'), (2021, 'q2')];
+    cols: Collection names.
+    
+    Returns
+    ----------
+    result: Error log.
+    """
+    rollup_list = rollup.frequency_rollup(frequency_client, counts_directory, list(cols), periods)
+    if len(rollup_list) == sum(rollup_list):
+        result = 'All rollup results saved with success'
+    else:
+        result = 'Check for rollup upload errors'
+    return result
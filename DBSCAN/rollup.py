@@ -0,0 +1,103 @@
+from utils import database_utils
+import execute
+import similarity
+import numpy as np
+
+
+def sum_similarities(similarities: list):
+    """
+    Sum the count matrices and the number of days of several periods.
+    Cities are aligned by name, a city missing in one period has no matching days in it.
+    Each quarterly count includes one match of every city pair from the constant collection column,
+    the sum keeps a single one as a direct run over the whole set of periods does.
+
+    Parameters
+    ----------
+    similarities: List of similarity.CondensedSimilarity.
+
+    Returns
+    ----------
+    rolled_similarity: similarity.CondensedSimilarity of the whole set of periods.
+    """
+    cities = list(dict.fromkeys(city for collection_similarity in similarities
+                                for city in collection_similarity.cities))
+    index = {city: i for i, city in enumerate(cities)}
+    n_cities = len(cities)
+    counts = np.zeros(n_cities * (n_cities - 1) // 2, dtype=np.int64)
+    # Number of periods including each city pair, each added its collection column match.
+    periods = np.zeros_like(counts)
+    n_dates = 0
+    for collection_similarity in similarities:
+        if collection_similarity.cities == cities:
+            counts += collection_similarity.counts
+            periods += 1
+        else:
+            position = np.array([index[city] for city in collection_similarity.cities])
+            rows, cols = np.triu_indices(len(position), 1)
+            pairs = similarity.condensed_index(n_cities, position[rows], position[cols])
+            counts[pairs] += collection_similarity.counts
+            periods[pairs] += 1
+        n_dates += collection_similarity.n_dates
+    counts += 1 - periods
+    assert counts.max(initial=0) <= np.iinfo(np.uint16).max, 'Too many days for uint16 counts.'
+    rolled_similarity = similarity.CondensedSimilarity(cities, counts.astype(np.uint16), n_dates)
+    return rolled_similarity
+
+
+def rollup_labels(periods: list):
+    """
+    Reference labels of a set of (year, quarter) periods, different sets of periods have different labels.
+    -ref_year: 'YYYY' or 'YYYY-YYYY' (first and last year);
+    -ref_quarter: single year, 'year' when all quarters are included, else the quarters joined by '-';
+    several years, every period as 'YYYYqN' joined by '-'. Periods are sorted.
+
+    Example:
+    [(2020, 'q1'), (2020, 'q2'), (2020, 'q3'), (2020, 'q4')] -> ('2020', 'year')
+    [(2020, 'q2'), (2020, 'q1')] -> ('2020', 'q1-q2')
+    [(2020, 'q4'), (2021, 'q1')] -> ('2020-2021', '2020q4-2021q1')
+    """
+    periods = sorted((int(year), q) for year, q in periods)
+    assert len(set(periods)) == len(periods), f"{periods} has repeated periods."
+    years = sorted({year for year, q in periods})
+    if len(years) == 1:
+        quarters = [q for year, q in periods]
+        ref_quarter = 'year' if quarters == ['q1', 'q2', 'q3', 'q4'] else '-'.join(quarters)
+        return str(years[0]), ref_quarter
+    ref_quarter = '-'.join(f'{year}{q}' for year, q in periods)
+    return f'{years[0]}-{years[-1]}', ref_quarter
+
+
+def rollup_collection(directory: str, col: str, periods: list):
+    """
+    Similarity of one collection over a set of (year, quarter) periods
+    from the saved quarterly count matrices.
+    """
+    similarities = [similarity.load_counts(directory, col, q, str(year)) for year, q in periods]
+    return sum_similarities(similarities)
+
+
+def frequency_rollup(insert_collection, directory: str, cols: list, periods: list):
+    """
+    For each collection group sum the saved quarterly count matrices of the periods
+    and upload the similarity of each city and every other city in the dataset.
+    No clustering and no raw data import is needed.
+
+    Parameters
+    ----------
+    insert_collection: Destination frequency collection MongoDB;
+    directory: Directory of the saved quarterly count matrices;
+    cols: Collection names;
+    periods: List of (year, quarter code) tuples, e.g. [(2021, 'q1'), (2021, 'q2')].
+
+    Returns
+    ----------
+    rollup_list: binary list with success inserts to MongoDB, (0=failure, 1=success).
+    """
+    ref_year, ref_quarter = rollup_labels(periods)
+    rollup_list = []
+    for col in cols:
+        rolled_similarity = rollup_collection(directory, col, periods)
+        frequency_dict = execute.frequency_to_dict(rolled_similarity, col, ref_quarter, ref_year)
+        ack = database_utils.try_mongo_insert(frequency_dict, insert_collection)
+        rollup_list.append(ack)
+    return rollup_list
@@ -22,7 +22,7 @@ def standard_scaler(dataframe: pd.DataFrame, features_list: list) -> np.ndarray:
     return scaled_table
 
 
-def dbscan_model(dataframe: pd.DataFrame, features_list: list, eps, min_samples):
+def dbscan_model(dataframe: pd.DataFrame, features_list: list, eps, min_samples, scaled=None):
     """
     Fit DBSCan model standard scaler + model fit
     
@@ -33,19 +33,21 @@ def dbscan_model(dataframe: pd.DataFrame, features_list: list, eps, min_samples)
     eps: Epsilon parameter DBSCAN, controls the local neighborhood of the points.
     min_samples: Minimum sample parameter DBSCAN, sets the minimum number of points per cluster,
     controls how tolerant the algorithm is towards noise.
+    scaled: Already standardized features of dataframe (e.g. a QuarterTensor day), scaled when None.
     
     Returns
     ----------
     dbscan_model_: Fitted DBSCAN Model.
     scaled: np.Array with standardized features.
     """
-    scaled = standard_scaler(dataframe, features_list)
+    if scaled is None:
+        scaled = standard_scaler(dataframe, features_list)
     dbscan_model_ = DBSCAN( eps = eps, min_samples = min_samples)
     dbscan_model_.fit(scaled)
     return dbscan_model_, scaled
 
 
-def dbscan(oneday_table: pd.DataFrame, features: list, eps: float, min_samples: int):
+def dbscan(oneday_table: pd.DataFrame, features: list, eps: float, min_samples: int, scaled=None):
     """
     - Fit DBSCan model standard scaler + model fit;
     - Add label column to original single day dataframe'.
@@ -57,6 +59,7 @@ def dbscan(oneday_table: pd.DataFrame, features: list, eps: float, min_samples:
     eps: Epsilon parameter DBSCAN, controls the local neighborhood of the points.
     min_samples: Minimum sample parameter DBSCAN, sets the minimum number of points per cluster,
     controls how tolerant the algorithm is towards noise.
+    scaled: Already standardized features of oneday_table, scaled when None.
     
     Returns
     ----------
@@ -64,6 +67,6 @@ def dbscan(oneday_table: pd.DataFrame, features: list, eps: float, min_samples:
     label_dataframe: Labeled column 'dbscan'.
     
     """
-    dbscan_model_, scaled = dbscan_model(oneday_table, features, eps, min_samples)
+    dbscan_model_, scaled = dbscan_model(oneday_table, features, eps, min_samples, scaled)
     label_dataframe = oneday_table.assign(dbscan = dbscan_model_.labels_)
     return label_dataframe, dbscan_model_
\ No newline at end of file
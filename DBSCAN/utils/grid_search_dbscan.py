@@ -1,7 +1,11 @@
 import pandas as pd
 import numpy as np
 from utils import clustering_dbscan
+from utils import sweep_dbscan
+from utils import quarter_tensor
+from utils import search_cache
 from sklearn.neighbors import NearestNeighbors
+from concurrent.futures import ProcessPoolExecutor
 
 
 def from_list_to_stats(metrics_dict: dict):
@@ -49,24 +53,27 @@ def transpose_df(dataframe: pd.DataFrame):
     return dataframe_
 
 
-def noise_mean_distance(dbscan_model_, scaled):
+def noise_mean_distance(labels: np.ndarray, scaled, knn_distances=None):
     """
     Clustering metric: Mean distance between noise points and its 6 Nearest Neighbours (6-NN)'.
     
     Parameters
     ----------
-    dbscan_model_: Fitted DBSCAN Model.
+    labels: DBSCAN labels of the fitted model.
     scaled: np.Array with standardized features.
+    knn_distances: Cached 6-NN distances of scaled (e.g. sweep_dbscan.DaySweep.knn_distances),
+    computed from scaled when None.
     
     Returns
     ----------
     noise_m_distance: float score, single value per fitted model.
     """
-    noise_indices = dbscan_model_.labels_ == -1
+    noise_indices = labels == -1
     if True in noise_indices:
-        neighboors = NearestNeighbors(n_neighbors=6).fit(scaled)
-        distances, indices = neighboors.kneighbors(scaled)
-        noise_distances = distances[noise_indices, 1:]
+        if knn_distances is None:
+            neighboors = NearestNeighbors(n_neighbors=6).fit(scaled)
+            knn_distances, indices = neighboors.kneighbors(scaled)
+        noise_distances = knn_distances[noise_indices, 1:]
         noise_m_distance = round(noise_distances.mean(), 3)
     else:
         noise_m_distance = None
@@ -92,26 +99,63 @@ def dbscan_grid_search(oneday_table: pd.DataFrame, features: list, eps, min_samp
     noise_m_distance: float score, single value per fitted model.
     """
     dbscan_model_, scaled = clustering_dbscan.dbscan_model(oneday_table, features, eps, min_samples)
-    noise_m_distance = noise_mean_distance(dbscan_model_, scaled)
+    noise_m_distance = noise_mean_distance(dbscan_model_.labels_, scaled)
     return dbscan_model_, noise_m_distance
 
 
-def cluster_collections_grid_search(oneday_table: pd.DataFrame, collections_features: dict,
-                                    eps: float, min_samples: int, metrics_dict: dict):
+def quarter_scaled(collections_table: pd.DataFrame, features: list, tensor=None):
     """
-    - Select only the last collection avaliable at collections_features;
-    - Fit DBSCan model standard scaler + model fit;
+    Standardized features of all dates in quarter, views of the quarter tensor.
+    
+    Parameters
+    ----------
+    collections_table: Quarter Dataframe to be scaled;
+    features: List of columns names (features) from dataframe to be standardized;
+    tensor: quarter_tensor.QuarterTensor of collections_table including features, built when None.
+    
+    Returns
+    ----------
+    scaled_days: List of np.Array with standardized features, one per date in quarter.
+    """
+    if tensor is None:
+        tensor = quarter_tensor.QuarterTensor(collections_table, features)
+    return [tensor.day(day, features) for day in range(len(tensor.dates))]
+
+
+def quarter_sweeps(collections_table: pd.DataFrame, features: list, max_eps: float, tensor=None):
+    """
+    For all dates in quarter standardize the features and build the neighbour graph of the day
+    at the largest tested epsilon.
+    
+    Parameters
+    ----------
+    collections_table: Quarter Dataframe to be scaled;
+    features: List of columns names (features) from dataframe to be standardized;
+    max_eps: Largest epsilon parameter DBSCAN to be tested;
+    tensor: quarter_tensor.QuarterTensor of collections_table including features, built when None.
+    
+    Returns
+    ----------
+    sweeps: List of sweep_dbscan.DaySweep, one per date in quarter.
+    """
+    scaled_days = quarter_scaled(collections_table, features, tensor)
+    return [sweep_dbscan.DaySweep(scaled, max_eps) for scaled in scaled_days]
+
+
+def cluster_collections_grid_search(day_sweep: sweep_dbscan.DaySweep, eps: float, min_samples: int,
+                                    metrics_dict: dict):
+    """
+    - Derive the single day DBSCAN labels from the neighbour graph of the day;
     - Calculate clustering metrics:
-        Mean distance between noise points and its 6 Nearest Neighbours (6-NN)';
+        Mean distance between noise points and its 6 Nearest Neighbours (6-NN)', from the cached
+        6-NN distances of the day;
         Number of clusters;
         Number of noise points.
     -Append clustering metrics to dictionary.
     
     Parameters
     ----------
-    oneday_table: single day Dataframe to be scaled;
-    collections_features: Dictionary with avaliable collections and columns names (features)
-    from dataframe to be standardized.
+    day_sweep: Neighbour graph of the single day standardized features;
     eps: Epsilon parameter DBSCAN, controls the local neighborhood of the points.
     min_samples: Minimum sample parameter DBSCAN, sets the minimum number of points per cluster,
     controls how tolerant the algorithm is towards noise.
@@ -121,21 +165,21 @@ def cluster_collections_grid_search(oneday_table: pd.DataFrame, collections_feat
     metrics_dict: Clustering metrics to dictionary.
     metrics_dict = {'noise_m_d': [], 'n_clusters': [], 'n_noise': []}
     """
-    features = list(collections_features.values())[-1]
-    dbscan_model_, noise_m_distance = dbscan_grid_search(oneday_table, features, eps, min_samples)
+    labels = day_sweep.labels(eps, min_samples)
+    noise_m_distance = noise_mean_distance(labels, day_sweep.scaled, day_sweep.knn_distances)
     metrics_dict['noise_m_d'].append(noise_m_distance)
-    metrics_dict['n_clusters'].append(len(set(dbscan_model_.labels_[dbscan_model_.labels_ >= 0])))
-    metrics_dict['n_noise'].append(list(dbscan_model_.labels_).count(-1))
+    metrics_dict['n_clusters'].append(len(set(labels[labels >= 0])))
+    metrics_dict['n_noise'].append(list(labels).count(-1))
     return metrics_dict
 
 
 def cluster_quarter_grid_search(collections_table: pd.DataFrame, collections_features: dict,
-                                eps: float, min_samples: int):
+                                eps: float, min_samples: int, sweeps=None, tensor=None):
     """
     -Update collections_features with combination of avaliable collections field;
     -Create metrics dictionary;
-    -List all dates in quarter;
-    -For all dates fit DBSCan model and calculate clustering metrics.
+    -Select only the last collection avaliable at collections_features;
+    -For all dates derive DBSCan labels and calculate clustering metrics.
     -Append clustering metrics to dictionary.
     
     Parameters
@@ -146,6 +190,9 @@ def cluster_quarter_grid_search(collections_table: pd.DataFrame, collections_fea
     eps: Epsilon parameter DBSCAN, controls the local neighborhood of the points.
     min_samples: Minimum sample parameter DBSCAN, sets the minimum number of points per cluster,
     controls how tolerant the algorithm is towards noise.
+    sweeps: Neighbour graphs of the quarter from quarter_sweeps, with max_eps >= eps.
+    Built for this eps when None.
+    tensor: quarter_tensor.QuarterTensor of collections_table, used to build the sweeps.
     
     Returns
     ----------
@@ -153,20 +200,54 @@ def cluster_quarter_grid_search(collections_table: pd.DataFrame, collections_fea
     metrics_dict = {'noise_m_d': [], 'n_clusters': [], 'n_noise': []}
     """
     collections_features = combine_keys_and_values(collections_features)
+    if sweeps is None:
+        features = list(collections_features.values())[-1]
+        sweeps = quarter_sweeps(collections_table, features, eps, tensor)
+    return cluster_sweeps_grid_search(sweeps, eps, min_samples)
+
+
+def cluster_sweeps_grid_search(sweeps: list, eps: float, min_samples: int):
+    """
+    -Create metrics dictionary;
+    -For all neighbour graphs of the quarter derive DBSCan labels and calculate clustering metrics.
+    """
     metrics_dict = {'noise_m_d': [], 'n_clusters': [], 'n_noise': []}
-    date_list = list(collections_table.data.unique())
-    for date in date_list:
-        oneday_table = collections_table[collections_table.data == date]
-        metrics_dict = cluster_collections_grid_search(oneday_table, collections_features, eps,
-                                                       min_samples, metrics_dict)
+    for day_sweep in sweeps:
+        metrics_dict = cluster_collections_grid_search(day_sweep, eps, min_samples, metrics_dict)
     return metrics_dict
 
 
-def grid_search(collections_table, collections_features, min_test, max_test):
+def hyperparameters_grid(min_test: int, max_test: int):
+    """
+    Combinations of hyperparameters tested by the grid search, in (eps, min_samples) order.
+    eps from 0.1 to 1.9 by 0.1, min_samples from min_test to max_test.
+    """
+    eps_to_test = [round(eps, 1) for eps in np.arange(0.1, 2, 0.1)]
+    min_samples_to_test = range(min_test, max_test + 1, 1)
+    return [(eps, min_samples) for eps in eps_to_test for min_samples in min_samples_to_test]
+
+
+def worker_grid_search(scaled_days: list, max_eps: float, grid: list):
+    """
+    Grid search worker process task: build the neighbour graphs of a block of consecutive dates and
+    calculate the clustering metrics of every combination of hyperparameters on them.
+
+    Returns
+    ----------
+    days_metrics: {(eps, min_samples): metrics_dict of the dates of the block, in date order}.
+    """
+    sweeps = [sweep_dbscan.DaySweep(scaled, max_eps) for scaled in scaled_days]
+    return {key: cluster_sweeps_grid_search(sweeps, *key) for key in grid}
+
+
+def grid_search(collections_table, collections_features, min_test, max_test, n_jobs=1, tensor=None, sweeps=None):
     """
+    -Build the neighbour graph of every date in quarter once, at the largest epsilon tested;
     -Calculate for all combinations of Hyperparameters the respective clustering metrics;
     -Calculate the descriptive statistics of the clustering metrics for the quarter;
     -Append clustering metrics descriptive statistics to dictionary.
+    With n_jobs > 1 the dates are split in blocks of consecutive dates among worker processes, each worker
+    builds the neighbour graphs of its own dates only and evaluates every combination on them.
     
     Parameters
     ----------
@@ -174,7 +255,11 @@ def grid_search(collections_table, collections_features, min_test, max_test):
     collections_features: Dictionary with avaliable collections and columns names (features)
     from dataframe to be standardized;
     min_test: Minimum value of min_samples to be tested;
-    max_test: Maximum value of min_samples to be tested.
+    max_test: Maximum value of min_samples to be tested;
+    n_jobs: Number of worker processes;
+    tensor: quarter_tensor.QuarterTensor of collections_table, built when None;
+    sweeps: Neighbour graphs of the quarter at the largest epsilon tested, built when None (n_jobs=1 only,
+    with n_jobs > 1 each worker builds the graphs of its dates).
     
     Returns
     ----------
@@ -183,16 +268,213 @@ def grid_search(collections_table, collections_features, min_test, max_test):
     results = {(eps, min_samples): {'noise_m_d': (mean, max, min), 'n_clusters': (mean, max, min),
     'n_noise': (mean, max, min)},
     """
-    eps_to_test = [round(eps, 1) for eps in np.arange(0.1, 2, 0.1)]
-    min_samples_to_test = range(min_test, max_test + 1, 1)
+    grid = hyperparameters_grid(min_test, max_test)
+    max_eps = max(eps for eps, min_samples in grid)
+    collections_features = combine_keys_and_values(collections_features)
+    features = list(collections_features.values())[-1]
+    scaled_days = quarter_scaled(collections_table, features, tensor)
+    results = {}
+    if n_jobs == 1:
+        if sweeps is None:
+            sweeps = [sweep_dbscan.DaySweep(scaled, max_eps) for scaled in scaled_days]
+        for key in grid:
+            metrics_dict = cluster_sweeps_grid_search(sweeps, *key)
+            results[key] = from_list_to_stats(metrics_dict)
+    else:
+        blocks = [block for block in np.array_split(np.arange(len(scaled_days)), n_jobs) if len(block)]
+        with ProcessPoolExecutor(max_workers=len(blocks)) as executor:
+            blocks_metrics = list(executor.map(worker_grid_search, [[scaled_days[day] for day in block]
+                                                                    for block in blocks],
+                                               [max_eps] * len(blocks), [grid] * len(blocks)))
+        for key in grid:
+            results[key] = from_list_to_stats(merge_days(dict(enumerate(days_metrics[key]
+                                                                        for days_metrics in blocks_metrics))))
+    return results
+
+
+def feasible_metrics(metrics_dict: dict, max_noise_percent: float, total_points=257):
+    """
+    Check the constraints of select_best_hyparameters on the single day clustering metrics
+    evaluated so far. Once violated on some days they are violated on the whole quarter.
+    -The maximum number of noise points should not be greater than {max_noise_percent};
+    -The minimum number of clusters should be greater than 2.
+    """
+    return (max(metrics_dict['n_noise']) <= total_points * max_noise_percent
+            and min(metrics_dict['n_clusters']) > 2)
+
+
+def merge_days(day_metrics: dict):
+    """
+    Merge the single day clustering metrics dictionaries {day index: metrics_dict} in date order.
+    """
+    metrics_dict = {'noise_m_d': [], 'n_clusters': [], 'n_noise': []}
+    for day in sorted(day_metrics):
+        for metric, values in day_metrics[day].items():
+            metrics_dict[metric] += values
+    return metrics_dict
+
+
+def pruned_grid_search(collections_table, collections_features, min_test, max_test, max_noise_percent,
+                       total_points=257, strides=(8, 4, 2, 1), tensor=None, sweeps=None, search_stats=None):
+    """
+    Successive halving grid search, selects the same hyperparameters as grid_search:
+    -Build the neighbour graph of every date in quarter once, at the largest epsilon tested;
+    -For each stride evaluate the surviving combinations of hyperparameters on the dates of the
+    quarter multiple of stride not yet evaluated;
+    -Eliminate the combinations that already violate the maximum noise or minimum clusters constraint;
+    -Calculate the descriptive statistics of the clustering metrics, in date order.
+    
+    Parameters
+    ----------
+    collections_table: Quarter Dataframe to be scaled;
+    collections_features: Dictionary with avaliable collections and columns names (features)
+    from dataframe to be standardized;
+    min_test: Minimum value of min_samples to be tested;
+    max_test: Maximum value of min_samples to be tested;
+    max_noise_percent: Maximum percentage of noise points allowed per model;
+    total_points: Number of rows on single day Dataframe to be scaled;
+    strides: Decreasing date strides of the rounds, the last one must be 1;
+    tensor: quarter_tensor.QuarterTensor of collections_table, built when None;
+    sweeps: Neighbour graphs of the quarter at the largest epsilon tested, built when None;
+    search_stats: Dictionary filled with the number of (combination, date) cells 'evaluated', None to skip.
+    
+    Returns
+    ----------
+    results: Clustering metrics descriptive statistics dictionary for every combination of
+    hyperparameters, as grid_search. Eliminated combinations keep the statistics of the dates
+    they were evaluated on, which still violate the constraints.
+    """
+    assert strides[-1] == 1, 'The last round must evaluate every date.'
+    grid = hyperparameters_grid(min_test, max_test)
+    max_eps = max(eps for eps, min_samples in grid)
+    collections_features = combine_keys_and_values(collections_features)
+    features = list(collections_features.values())[-1]
+    if sweeps is None:
+        sweeps = quarter_sweeps(collections_table, features, max_eps, tensor)
+    evaluated = {key: {} for key in grid}
+    evaluated_days = set()
+    survivors = grid
+    for stride in strides:
+        if not survivors:
+            break
+        days = [day for day in range(0, len(sweeps), stride) if day not in evaluated_days]
+        evaluated_days.update(days)
+        for key in survivors:
+            for day in days:
+                evaluated[key][day] = cluster_collections_grid_search(
+                    sweeps[day], *key, {'noise_m_d': [], 'n_clusters': [], 'n_noise': []})
+        survivors = [key for key in survivors
+                     if feasible_metrics(merge_days(evaluated[key]), max_noise_percent, total_points)]
+    results = {key: from_list_to_stats(merge_days(evaluated[key])) for key in grid}
+    if search_stats is not None:
+        search_stats['evaluated'] = sum(len(days) for days in evaluated.values())
+    return results
+
+
+def warm_grid_search(collections_table, collections_features, min_test, max_test, max_noise_percent, seed,
+                     total_points=257, tensor=None, sweeps=None):
+    """
+    Narrowed grid search warm started from a previous best combination of hyperparameters:
+    -Build the neighbour graph of every date in quarter once, at the largest epsilon tested;
+    -Evaluate the combinations of the grid within 1 step of seed (eps and min_samples grid steps);
+    -While none of the evaluated combinations meets the maximum noise and minimum clusters constraints,
+    widen the window by 1 step and evaluate the new combinations, up to the whole grid.
+    The selection can differ from grid_search when the best combination is outside the window.
+    
+    Parameters
+    ----------
+    collections_table: Quarter Dataframe to be scaled;
+    collections_features: Dictionary with avaliable collections and columns names (features)
+    from dataframe to be standardized;
+    min_test: Minimum value of min_samples to be tested;
+    max_test: Maximum value of min_samples to be tested;
+    max_noise_percent: Maximum percentage of noise points allowed per model;
+    seed: (eps, min_samples) tuple, e.g. the best combination of the previous quarter;
+    total_points: Number of rows on single day Dataframe to be scaled;
+    tensor: quarter_tensor.QuarterTensor of collections_table, built when None;
+    sweeps: Neighbour graphs of the quarter at the largest epsilon tested, built when None.
+    
+    Returns
+    ----------
+    results: Clustering metrics descriptive statistics dictionary for the evaluated combinations of
+    hyperparameters, as grid_search. len(results) is the number of combinations evaluated.
+    """
+    grid = hyperparameters_grid(min_test, max_test)
+    eps_to_test = sorted({eps for eps, min_samples in grid})
+    min_samples_to_test = sorted({min_samples for eps, min_samples in grid})
+    eps_seed = int(np.argmin(np.abs(np.array(eps_to_test) - seed[0])))
+    min_samples_seed = int(np.argmin(np.abs(np.array(min_samples_to_test) - seed[1])))
+    collections_features = combine_keys_and_values(collections_features)
+    features = list(collections_features.values())[-1]
+    if sweeps is None:
+        sweeps = quarter_sweeps(collections_table, features, max(eps_to_test), tensor)
+    results = {}
+    feasible = False
+    radius = 1
+    while not feasible and len(results) < len(grid):
+        for key in grid:
+            distance = max(abs(eps_to_test.index(key[0]) - eps_seed),
+                           abs(min_samples_to_test.index(key[1]) - min_samples_seed))
+            if key in results or distance > radius:
+                continue
+            metrics_dict = cluster_sweeps_grid_search(sweeps, *key)
+            feasible = feasible or feasible_metrics(metrics_dict, max_noise_percent, total_points)
+            results[key] = from_list_to_stats(metrics_dict)
+        radius += 1
+    return results
+
+
+def knee_distance(k_distances: np.ndarray) -> float:
+    """
+    Knee of the sorted k-distance curve: the point furthest below the line joining the first and
+    the last points of the curve, both axes normalized to [0, 1].
+    """
+    curve = np.sort(k_distances)
+    if curve[-1] == curve[0]:
+        return float(curve[-1])
+    x = np.linspace(0, 1, len(curve))
+    y = (curve - curve[0]) / (curve[-1] - curve[0])
+    return float(curve[np.argmax(x - y)])
+
+
+def knee_search(collections_table, collections_features, min_test, max_test, tensor=None):
+    """
+    k-distance knee search, an alternative to the grid for the epsilon parameter:
+    -For all dates in quarter calculate the distance of every point to its max_test nearest neighbours;
+    -For each min_samples estimate eps as the median over the dates of the knee of the sorted
+    k-distance curve, with k = min_samples (the point itself included, as DBSCAN core points);
+    -Calculate the clustering metrics of each (eps, min_samples) on every date, as grid_search.
+    eps is continuous, rounded to 3 decimals, instead of the 0.1 steps of the grid.
+    
+    Parameters
+    ----------
+    collections_table: Quarter Dataframe to be scaled;
+    collections_features: Dictionary with avaliable collections and columns names (features)
+    from dataframe to be standardized;
+    min_test: Minimum value of min_samples to be tested;
+    max_test: Maximum value of min_samples to be tested;
+    tensor: quarter_tensor.QuarterTensor of collections_table, built when None.
+    
+    Returns
+    ----------
+    results: Clustering metrics descriptive statistics dictionary for every estimated combination of
+    hyperparameters, as grid_search.
+    """
+    collections_features = combine_keys_and_values(collections_features)
+    features = list(collections_features.values())[-1]
+    scaled_days = quarter_scaled(collections_table, features, tensor)
+    knees = {min_samples: [] for min_samples in range(min_test, max_test + 1, 1)}
+    for scaled in scaled_days:
+        distances, indices = NearestNeighbors(n_neighbors=max_test).fit(scaled).kneighbors(scaled)
+        for min_samples in knees:
+            knees[min_samples].append(knee_distance(distances[:, min_samples - 1]))
+    grid = [(round(float(np.median(knee)), 3), min_samples) for min_samples, knee in knees.items()]
+    grid = [(eps, min_samples) for eps, min_samples in grid if eps > 0]
     results = {}
-    for eps in eps_to_test:
-        for min_samples in min_samples_to_test:
-            metrics_dict = cluster_quarter_grid_search(collections_table, collections_features,
-                                                       eps, min_samples)
-            metrics_dict = from_list_to_stats(metrics_dict)
-            key = (eps, min_samples)
-            results[key] = metrics_dict
+    if grid:
+        sweeps = [sweep_dbscan.DaySweep(scaled, max(eps for eps, min_samples in grid)) for scaled in scaled_days]
+        for key in grid:
+            results[key] = from_list_to_stats(cluster_sweeps_grid_search(sweeps, *key))
     return results
 
 
@@ -218,6 +500,8 @@ def select_best_hyparameters(results: dict, max_noise_percent: float, total_poin
     best_hp: best combination of hyperparameters tuple, (eps, min_samples).
     """
     backup = (1.4, 2)
+    if not results:
+        return backup
     df = from_dict_to_df(results)
     table = transpose_df(df)
     first_cond = list(
@@ -239,7 +523,25 @@ def select_best_hyparameters(results: dict, max_noise_percent: float, total_poin
     return best_hp
 
 
-def best_hyperparameters(collections_table, collections_features, min_test=2, max_test=5, max_noise_percent=0.33):
+def selected_models(collections_table, collections_features, eps, min_samples, tensor=None, sweeps=None):
+    """
+    Single day DBSCAN models of the combination of all collections for (eps, min_samples),
+    built from the neighbour graphs of the search without fitting. Neighbour graphs at eps are built
+    when sweeps is None or does not reach eps.
+    
+    Returns
+    ----------
+    grid_models: {(eps, min_samples): List of DBSCAN models, one per date in quarter}.
+    """
+    if sweeps is None or sweeps[0].max_eps < eps:
+        features = list(combine_keys_and_values(collections_features).values())[-1]
+        sweeps = quarter_sweeps(collections_table, features, eps, tensor)
+    return {(eps, min_samples): [day_sweep.model(eps, min_samples) for day_sweep in sweeps]}
+
+
+def best_hyperparameters(collections_table, collections_features, min_test=2, max_test=5, max_noise_percent=0.33,
+                         n_jobs=1, strategy='grid', tensor=None, cache_directory=None, cache_max_bytes=2 ** 30,
+                         seed=None, grid_models=None, search_stats=None):
     """
     Grid search and select best Hyperparameters combination for DBSCAN clustering.
     
@@ -251,14 +553,75 @@ def best_hyperparameters(collections_table, collections_features, min_test=2, ma
     min_test: Minimum value of min_samples to be tested;
     max_test: Maximum value of min_samples to be tested.
     max_noise_percent: Maximum percentage of noise points allowed per model.
+    n_jobs: Number of grid search worker processes;
+    strategy: Search strategy:
+        'grid': every combination of hyperparameters on every date;
+        'pruned': successive halving on the dates, same selection as 'grid' (n_jobs not used);
+        'warm': narrowed search around seed, widened until a combination meets the constraints,
+        'grid' when seed is None (n_jobs not used);
+        'knee': eps from the knee of the k-distance curve for each min_samples, continuous (n_jobs not used).
+    tensor: quarter_tensor.QuarterTensor of collections_table, shared with the final clustering,
+    built when None;
+    cache_directory: Directory of the searches cache, keyed by the content hash of collections_table,
+    the features and the grid definition. A cached search is not run again. None to skip;
+    cache_max_bytes: Size of the searches cache, least recently used searches are evicted beyond it;
+    seed: 'warm' strategy only, (eps, min_samples) of the previous quarter;
+    grid_models: Dictionary filled with the single day models of the selected combination of hyperparameters
+    {(eps, min_samples): [models per date]}, built from the neighbour graphs of the search, for
+    execute.cluster_quarter to reuse. None to skip.
+    search_stats: Dictionary filled with the search strategy, the number of (combination, date) cells 'evaluated'
+    and of cells of the whole grid ('cells'), and whether the search was 'cached' (no cell evaluated). None to skip.
     
     Returns
     ----------
     eps: Best epsilon parameter DBSCAN clustering.
     min_samples: Best minimum sample parameter DBSCAN clustering.
     """
-    results = grid_search(collections_table, collections_features, min_test, max_test)
+    assert strategy in ('grid', 'pruned', 'warm', 'knee'), f'Unknown search strategy {strategy}.'
+    if strategy == 'warm' and seed is None:
+        strategy = 'grid'
+    n_dates = len(tensor.dates) if tensor is not None else collections_table.data.nunique()
+    n_cells = len(hyperparameters_grid(min_test, max_test)) * n_dates
+    if search_stats is not None:
+        search_stats.update({'strategy': strategy, 'evaluated': 0, 'cells': n_cells, 'cached': False})
+    if cache_directory is not None:
+        warm_seed = {'seed': tuple(seed)} if strategy == 'warm' else {}
+        key = search_cache.cache_key(collections_table, combine_keys_and_values(dict(collections_features)),
+                                     grid=hyperparameters_grid(min_test, max_test),
+                                     max_noise_percent=max_noise_percent, strategy=strategy, **warm_seed)
+        entry = search_cache.load_search(cache_directory, key)
+        if entry is not None:
+            eps, min_samples = entry['best_hp']
+            if search_stats is not None:
+                search_stats['cached'] = True
+            if grid_models is not None:
+                grid_models.update(selected_models(collections_table, collections_features, eps, min_samples, tensor))
+            return eps, min_samples
+    sweeps = None
+    # The parallel grid search builds the neighbour graphs in its workers, the models of the selected
+    # combination are then built from graphs at its eps only.
+    if grid_models is not None and strategy != 'knee' and not (strategy == 'grid' and n_jobs > 1):
+        features = list(combine_keys_and_values(collections_features).values())[-1]
+        max_eps = max(eps for eps, min_samples in hyperparameters_grid(min_test, max_test))
+        sweeps = quarter_sweeps(collections_table, features, max_eps, tensor)
+    if strategy == 'pruned':
+        results = pruned_grid_search(collections_table, collections_features, min_test, max_test, max_noise_percent,
+                                     tensor=tensor, sweeps=sweeps, search_stats=search_stats)
+    elif strategy == 'knee':
+        results = knee_search(collections_table, collections_features, min_test, max_test, tensor)
+    elif strategy == 'warm':
+        results = warm_grid_search(collections_table, collections_features, min_test, max_test, max_noise_percent,
+                                   seed, tensor=tensor, sweeps=sweeps)
+    else:
+        results = grid_search(collections_table, collections_features, min_test, max_test, n_jobs, tensor, sweeps)
+    if search_stats is not None and strategy != 'pruned':
+        search_stats['evaluated'] = len(results) * n_dates
     best_hp = select_best_hyparameters(results, max_noise_percent)
     eps = best_hp[0]
     min_samples = best_hp[1]
+    if cache_directory is not None:
+        search_cache.save_search(cache_directory, key, {'results': results, 'best_hp': (eps, min_samples)},
+                                 cache_max_bytes)
+    if grid_models is not None:
+        grid_models.update(selected_models(collections_table, collections_features, eps, min_samples, tensor, sweeps))
     return eps, min_samples
@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import logging
+import pickle
+import json
+import os
+
+
+def cache_key(collections_table: pd.DataFrame, collections_features: dict, **grid_definition) -> str:
+    """
+    Content hash of a hyperparameters search input:
+    -Quarter Dataframe values, columns names and rows order;
+    -Collections and columns names (features);
+    -Grid definition, e.g. min_test, max_test, max_noise_percent, strategy.
+
+    Returns
+    ----------
+    key: sha256 hex digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(collections_table, index=False).to_numpy().tobytes())
+    digest.update(json.dumps([list(map(str, collections_table.columns)),
+                              {collection: list(features) for collection, features in collections_features.items()},
+                              {name: repr(value) for name, value in sorted(grid_definition.items())}]).encode())
+    return digest.hexdigest()
+
+
+def cache_path(directory: str, key: str):
+    """
+    File path of a cached hyperparameters search.
+    """
+    return os.path.join(directory, f'search_{key}.pickle')
+
+
+def load_search(directory: str, key: str):
+    """
+    Load a cached hyperparameters search and mark it as recently used.
+
+    Returns
+    ----------
+    entry: {'results': grid search results, 'best_hp': (eps, min_samples)}, None when not cached.
+    """
+    path = cache_path(directory, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            entry = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        logging.warning(f'Unable to read cached hyperparameters search {path}')
+        return None
+    os.utime(path)
+    return entry
+
+
+def save_search(directory: str, key: str, entry: dict, max_bytes=2 ** 30):
+    """
+    Save a hyperparameters search to the cache directory, then evict the least recently
+    used searches until the directory holds at most max_bytes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = cache_path(directory, key)
+    with open(f'{path}.tmp', 'wb') as file:
+        pickle.dump(entry, file)
+    os.replace(f'{path}.tmp', path)
+    evict(directory, max_bytes, keep=path)
+
+
+def evict(directory: str, max_bytes: int, keep=None):
+    """
+    Remove the least recently used cached searches (oldest modification time first)
+    while the cache directory is larger than max_bytes. keep is never removed.
+    """
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if name.startswith('search_') and name.endswith('.pickle')]
+    stats = [os.stat(path) for path in paths]
+    total = sum(stat.st_size for stat in stats)
+    for position in np.argsort([stat.st_mtime_ns for stat in stats], kind='stable'):
+        if total <= max_bytes:
+            break
+        if paths[position] == keep:
+            continue
+        os.remove(paths[position])
+        total -= stats[position].st_size
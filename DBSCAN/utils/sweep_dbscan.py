@@ -0,0 +1,108 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from sklearn.neighbors import NearestNeighbors
+from sklearn.cluster import DBSCAN
+
+
+class DaySweep:
+    """
+    Neighbour graph of a single day, derives the DBSCAN labels of every (eps, min_samples)
+    combination with eps <= max_eps without refitting.
+
+    A single radius neighbours query at max_eps is run, with sorted distances, then for each
+    combination:
+        -Core points: points with at least min_samples neighbours (itself included) within eps;
+        -Clusters: connected components of the core points graph, numbered by their lowest core index;
+        -Border points: non core points within eps of a core point, joined to the lowest cluster among
+        their core neighbours;
+        -Noise points: the remaining ones, label -1.
+    Same labels as sklearn.cluster.DBSCAN fitted with the same hyperparameters.
+
+    Parameters
+    ----------
+    scaled: np.Array with standardized features;
+    max_eps: Largest epsilon parameter DBSCAN of the sweep.
+    """
+
+    def __init__(self, scaled: np.ndarray, max_eps: float):
+        self.scaled = scaled
+        self.max_eps = max_eps
+        self.n_points = len(scaled)
+        neighbours = NearestNeighbors(radius=max_eps).fit(scaled)
+        distances, indices = neighbours.radius_neighbors(scaled, sort_results=True)
+        lengths = np.array([len(row) for row in indices])
+        self.rows = np.repeat(np.arange(self.n_points), lengths)
+        self.cols = np.concatenate(indices).astype(np.intp)
+        self.distances = np.concatenate(distances)
+        self._eps_cache = {}
+        self._knn_distances = None
+
+    @property
+    def knn_distances(self) -> np.ndarray:
+        """
+        Distances of every point to its 6 Nearest Neighbours (itself included), computed once per day
+        on first use and shared by all (eps, min_samples) combinations.
+        """
+        if self._knn_distances is None:
+            neighbours = NearestNeighbors(n_neighbors=6).fit(self.scaled)
+            self._knn_distances, _ = neighbours.kneighbors(self.scaled)
+        return self._knn_distances
+
+    def neighbourhood(self, eps: float):
+        """
+        Edges within eps and number of neighbours (itself included) of every point.
+        """
+        if eps not in self._eps_cache:
+            assert eps <= self.max_eps, f'eps {eps} greater than the sweep radius {self.max_eps}.'
+            within = self.distances <= eps
+            n_neighbours = np.bincount(self.rows[within], minlength=self.n_points)
+            self._eps_cache[eps] = (within, n_neighbours)
+        return self._eps_cache[eps]
+
+    def core(self, eps: float, min_samples: int) -> np.ndarray:
+        """
+        Core points mask of the day for (eps, min_samples).
+        """
+        within, n_neighbours = self.neighbourhood(eps)
+        return n_neighbours >= min_samples
+
+    def model(self, eps: float, min_samples: int) -> DBSCAN:
+        """
+        DBSCAN model of the day for (eps, min_samples), with the attributes of a fit on scaled
+        (labels_, core_sample_indices_, components_) set from the neighbour graph instead of fitting.
+        """
+        dbscan_model_ = DBSCAN(eps=eps, min_samples=min_samples)
+        dbscan_model_.labels_ = self.labels(eps, min_samples)
+        dbscan_model_.core_sample_indices_ = np.flatnonzero(self.core(eps, min_samples))
+        dbscan_model_.components_ = self.scaled[dbscan_model_.core_sample_indices_].copy()
+        dbscan_model_.n_features_in_ = self.scaled.shape[1]
+        return dbscan_model_
+
+    def labels(self, eps: float, min_samples: int) -> np.ndarray:
+        """
+        DBSCAN labels of the day for (eps, min_samples).
+        """
+        within, n_neighbours = self.neighbourhood(eps)
+        core = self.core(eps, min_samples)
+        labels = np.full(self.n_points, -1, dtype=np.intp)
+        core_index = np.flatnonzero(core)
+        if not len(core_index):
+            return labels
+        rows, cols = self.rows[within], self.cols[within]
+        core_edges = core[rows] & core[cols]
+        position = np.cumsum(core) - 1
+        graph = sparse.csr_matrix((np.ones(core_edges.sum(), dtype=np.int8),
+                                   (position[rows[core_edges]], position[cols[core_edges]])),
+                                  shape=(len(core_index), len(core_index)))
+        n_components, components = csgraph.connected_components(graph, directed=False)
+        _, first_core = np.unique(components, return_index=True)
+        order = np.empty(n_components, dtype=np.intp)
+        order[np.argsort(first_core)] = np.arange(n_components)
+        labels[core_index] = order[components]
+        border_edges = ~core[rows] & core[cols]
+        border = np.full(self.n_points, n_components, dtype=np.intp)
+        np.minimum.at(border, rows[border_edges], labels[cols[border_edges]])
+        is_border = border < n_components
+        labels[is_border] = border[is_border]
+        return labels
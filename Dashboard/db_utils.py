@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import geopandas as gpd
 import plotly.express as px
 import pyproj
@@ -142,6 +143,92 @@ def query_db_similarity(client, collections, year, season, ref_city):
     return labeled_dataframe
 
 
+def decode_packed_similarity(document):
+    """
+    Decode a packed similarity document to the square percentual of days matrix.
+
+    Parameters
+    ----------
+    document: Packed similarity document with cities, n_dates, dtype and the
+    condensed upper triangle counts as binary.
+
+    Returns
+    ----------
+    cities: list of cities;
+    perc_sim: np.array (cities x cities) percentual of days each city pair is classified in the same cluster.
+    """
+    cities = document['cities']
+    n_cities = len(cities)
+    condensed = np.frombuffer(document['counts'], dtype=document['dtype'])
+    counts = np.zeros((n_cities, n_cities), dtype=np.int64)
+    rows, cols = np.triu_indices(n_cities, 1)
+    counts[rows, cols] = condensed
+    counts[cols, rows] = condensed
+    perc_sim = np.round((counts / document['n_dates']) * 100, 2)
+    return cities, perc_sim
+
+
+def query_db_packed_similarity(client, collections, year, season, ref_city):
+    """
+    -Access the packed Frequency_season collection;
+    -Get the single packed document of the collection and season by _id;
+    -Format the dataframe as query_db_similarity().
+
+    Parameters
+    ----------
+    client: MongoClient with specified database and collection;
+    collections: list of collections "['Atmosphere', 'Climate']";
+    year: str;
+    season: str in ['Winter', 'Spring', 'Summer', 'Autumn'];
+    ref_city: str reference city in the packed document cities.
+
+    Returns
+    ----------
+    labeled_dataframe: similarity among cities plot dataframe, empty when the document or the city is missing.
+    """
+    selected_collection = collection_label_to_key(collections)
+    selected_quarter = season_to_quarter(season)
+    selected_city = ref_city.replace(" ", "_")
+    document = client.find_one({"_id": f'{selected_collection}_{selected_quarter}_{year}'})
+    if not document or selected_city not in document['cities']:
+        return pd.DataFrame(columns=['COMUNE', 'perc_sim'])
+    cities, perc_sim = decode_packed_similarity(document)
+    ref_index = cities.index(selected_city)
+    labeled_dataframe = pd.DataFrame({'COMUNE': cities, 'perc_sim': perc_sim[ref_index]}).drop(index=ref_index)
+    labeled_dataframe['COMUNE'] = labeled_dataframe['COMUNE'].str.replace("_", " ")
+    return labeled_dataframe.reset_index(drop=True)
+
+
+def query_db_neighbours(client, collections, year, season, ref_city, k=None):
+    """
+    -Access the top k most similar cities collection;
+    -Get the single document of the reference city by _id;
+    -Format the ranked neighbours dataframe.
+
+    Parameters
+    ----------
+    client: MongoClient with specified database and collection;
+    collections: list of collections "['Atmosphere', 'Climate']";
+    year: str;
+    season: str in ['Winter', 'Spring', 'Summer', 'Autumn'];
+    ref_city: str reference city in list(client.distinct('ref_COMUNE'));
+    k: number of most similar cities, None for all stored neighbours.
+
+    Returns
+    ----------
+    labeled_dataframe: most similar cities dataframe ranked by percentual of days in the same cluster.
+    """
+    selected_collection = collection_label_to_key(collections)
+    selected_quarter = season_to_quarter(season)
+    selected_city = ref_city.replace(" ", "_")
+    document = client.find_one({"_id": f'{selected_city}_{selected_collection}_{selected_quarter}_{year}'})
+    neighbours = document['neighbours'] if document else []
+    labeled_dataframe = pd.DataFrame(neighbours[:k], columns=['COMUNE', 'perc_sim'])
+    labeled_dataframe['COMUNE'] = labeled_dataframe['COMUNE'].str.replace("_", " ")
+    labeled_dataframe.insert(0, 'rank', range(1, len(labeled_dataframe) + 1))
+    return labeled_dataframe
+
+
 def similarity_plot(labeled_dataframe : pd.DataFrame, city_geo : gpd.geodataframe.GeoDataFrame):
     '''
     -Add georeferenced poligon to each municipality;
@@ -2,11 +2,20 @@ from utils import database_utils
 from utils import geo_utils
 from utils import cluster_utils
 from utils import mongo_handler
+from utils import quarter_tensor
+from utils import batched_kmeans
 from functools import reduce
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import util
+from bson.binary import Binary
 import similarity
 import pandas as pd
+import numpy as np
 import geopandas as gpd
 
+# Quarter of each day clustering worker process, set once by init_day_worker.
+_worker_quarter = None
+
 
 ################################
 # ImportAndArrangement
@@ -55,21 +64,37 @@ def create_tables(mongo_client, database: str, collections: dict, year: str, reg
 # QuarterKmeansClustering
 
 
-def cluster_collections(oneday_table: pd.DataFrame, collections_features: dict):
+def cluster_collections(oneday_table: pd.DataFrame, collections_features: dict, tensor=None, day=None,
+                        warm_start=None, day_labels=None, approximate=None, k_search=None):
     """
     -Kmeans clusters with features from all collections;
     -Kmeans clusters with features from each collection individually;
     -Add collection group column for reference.
+    With a quarter tensor the standardized features are the columns of the day in it,
+    with warm_start the Kmeans fits start from the previous day centroids,
+    collections in day_labels ({collection: labels}) take those labels and are not fitted again,
+    with approximate (cluster_utils.KmeansApproximate) the fits are MiniBatchKMeans scored on a sample,
+    with k_search (cluster_utils.AdaptiveKSearch) only part of the numbers of clusters are evaluated.
     """
     # Architecture allows only 2 collections, to be expanded to all n collections.
+    day_labels = day_labels or {}
     labeled_list = []
     all_features = list(oneday_table.iloc[:, 2:].columns)
-    labeled = cluster_utils.best_kmeans(oneday_table, all_features)
+    all_collection = f'{list(collections_features.items())[0][0]}_{list(collections_features.items())[1][0]}'
+    if all_collection in day_labels:
+        labeled = oneday_table.assign(kcls_std=day_labels[all_collection])
+    else:
+        scaled = tensor.day(day, all_features) if tensor is not None else None
+        labeled = cluster_utils.best_kmeans(oneday_table, all_features, scaled, warm_start, approximate, k_search)
     labeled = labeled[['COMUNE', 'kcls_std']]
-    labeled['collection'] = f'{list(collections_features.items())[0][0]}_{list(collections_features.items())[1][0]}'
+    labeled['collection'] = all_collection
     labeled_list.append(labeled)
     for collection, features in collections_features.items():
-        labeled = cluster_utils.best_kmeans(oneday_table, features)
+        if collection in day_labels:
+            labeled = oneday_table.assign(kcls_std=day_labels[collection])
+        else:
+            scaled = tensor.day(day, features) if tensor is not None else None
+            labeled = cluster_utils.best_kmeans(oneday_table, features, scaled, warm_start, approximate, k_search)
         labeled = labeled[['COMUNE', 'kcls_std']]
         labeled['collection'] = collection
         labeled_list.append(labeled)
@@ -77,19 +102,132 @@ def cluster_collections(oneday_table: pd.DataFrame, collections_features: dict):
     return oneday_labeled
 
 
-def cluster_quarter(quarter_table: pd.DataFrame, collections_features: dict):
+def batched_labels(tensor, collections_features: dict) -> list:
+    """
+    Kmeans labels of every date and collection group of a quarter with the batched engine,
+    days with the same number of cities are clustered in a single batch.
+
+    Returns
+    ----------
+    quarter_labels: List of {collection: labels} per date, in tensor order.
+    """
+    all_collection = f'{list(collections_features.items())[0][0]}_{list(collections_features.items())[1][0]}'
+    groups = {all_collection: tensor.features, **collections_features}
+    quarter_labels = [{} for _ in tensor.dates]
+    for n_cities in np.unique(tensor.n_cities):
+        days = np.flatnonzero(tensor.n_cities == n_cities)
+        for collection, features in groups.items():
+            values = tensor.values[days, :n_cities][:, :, tensor.columns(features)]
+            labels, n_clusters = batched_kmeans.best_kmeans_quarter(values)
+            for day, day_labels in zip(days, labels):
+                quarter_labels[day][collection] = day_labels
+    return quarter_labels
+
+
+def init_day_worker(quarter_table: pd.DataFrame, collections_features: dict, tensor, approximate=None,
+                    k_search=None):
+    """
+    Day clustering worker process initializer: keep the quarter Dataframe and its tensor,
+    whose values are mapped from shared memory, once per worker. The shared memory handle is closed when the
+    worker exits.
+    """
+    global _worker_quarter
+    _worker_quarter = (quarter_table, collections_features, tensor, approximate, k_search)
+    util.Finalize(tensor, tensor.detach, exitpriority=0)
+
+
+def worker_cluster_day(day: int, day_labels=None):
+    """
+    Kmeans clusters of one date of the worker process quarter, as cluster_collections,
+    with the k_search counters counted for the date (None without k_search).
+    """
+    quarter_table, collections_features, tensor, approximate, k_search = _worker_quarter
+    oneday_table = tensor.day_table(quarter_table, day)
+    counters = dict(k_search.counters) if k_search is not None else None
+    oneday_labeled = cluster_collections(oneday_table, collections_features, tensor, day, day_labels=day_labels,
+                                         approximate=approximate, k_search=k_search)
+    if counters is not None:
+        counters = {key: k_search.counters[key] - count for key, count in counters.items()}
+    return oneday_labeled, counters
+
+
+def cluster_days(quarter_table: pd.DataFrame, collections_features: dict, tensor, quarter_labels: list,
+                 warm_start=None, n_jobs=1, approximate=None, k_search=None):
+    """
+    Kmeans clusters of every date of the quarter, yielded in date order.
+    With n_jobs > 1 the dates are split among worker processes, the tensor values are shared
+    through shared memory and the quarter Dataframe is sent to each worker only once
+    (k_search counters are counted in the workers and added back to k_search).
+    The k_search counters of each date are recorded in k_search.days.
+    """
+    assert n_jobs == 1 or warm_start is None, 'Warm start clusters the dates sequentially, use n_jobs=1.'
+    if n_jobs == 1:
+        for day, date in enumerate(tensor.dates):
+            oneday_table = tensor.day_table(quarter_table, day)
+            counters = dict(k_search.counters) if k_search is not None else None
+            oneday_labeled = cluster_collections(oneday_table, collections_features, tensor, day, warm_start,
+                                                 quarter_labels[day], approximate, k_search)
+            if counters is not None:
+                k_search.add_day(date, {key: k_search.counters[key] - count for key, count in counters.items()})
+            yield oneday_labeled
+        return
+    n_dates = len(tensor.dates)
+    tensor.share()
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_day_worker,
+                                 initargs=(quarter_table, collections_features, tensor, approximate,
+                                           k_search)) as executor:
+            # Chunks of days save round trips to the workers, as DBSCAN cluster_days.
+            chunksize = max(1, n_dates // (4 * n_jobs))
+            for date, (oneday_labeled, counters) in zip(tensor.dates,
+                                                        executor.map(worker_cluster_day, range(n_dates),
+                                                                     quarter_labels, chunksize=chunksize)):
+                if counters is not None:
+                    k_search.add_day(date, counters, count=True)
+                yield oneday_labeled
+    finally:
+        tensor.unshare()
+
+
+def cluster_quarter(quarter_table: pd.DataFrame, collections_features: dict, accumulator=None, keep_labels=True,
+                    warm_start=None, engine='sklearn', n_jobs=1, approximate=None, k_search=None, deviation=None):
     """
+    -Standardize the features of every date in quarter at once, as a (day, city, feature) tensor;
     -List all dates in quarter;
-    -Fit Kmeans clusters for each date.
+    -Fit Kmeans clusters for each date, warm started from the previous date with a cluster_utils.KmeansWarmStart;
+    -Feed each date labels to the similarity accumulator, if any;
+    -If keep_labels is False the labeled dates are not kept and quarter_labeled is None.
+    engine='batched' fits every date and number of clusters at once with batched_kmeans instead of
+    one sklearn KMeans per date and number of clusters (same selection, different initialization draws).
+    With n_jobs > 1 the dates are clustered in worker processes, see cluster_days,
+    with approximate (cluster_utils.KmeansApproximate) the sklearn engine fits MiniBatchKMeans
+    and selects the number of clusters on a sample silhouette score, with k_search
+    (cluster_utils.AdaptiveKSearch) it stops the number of clusters sweep early.
+    With approximate, deviation is filled with cluster_utils.approximate_deviation of the combination of
+    all collections on the dates of the quarter (an exact sweep of every date on top of the clustering).
     """
-    date_list = list(quarter_table.data.unique())
+    assert engine in ['sklearn', 'batched'], f"{engine} is not a valid Kmeans engine."
+    assert engine == 'sklearn' or warm_start is None, 'Warm start is only available with the sklearn engine.'
+    assert engine == 'sklearn' or approximate is None, 'Approximate mode is only available with the sklearn engine.'
+    assert engine == 'sklearn' or k_search is None, 'Adaptive search is only available with the sklearn engine.'
+    tensor = quarter_tensor.QuarterTensor(quarter_table, quarter_table.columns[2:])
+    date_list = tensor.dates
     n_dates = len(date_list)
+    quarter_labels = batched_labels(tensor, collections_features) if engine == 'batched' else [None] * n_dates
+    if approximate is not None and deviation is not None:
+        scaled_list = [tensor.day(day) for day in range(n_dates)]
+        deviation.update(cluster_utils.approximate_deviation(scaled_list, approximate))
     oneday_list = []
-    for date in date_list:
-        oneday_table = quarter_table[quarter_table.data == date]
-        oneday_labeled = cluster_collections(oneday_table, collections_features)
-        oneday_labeled.rename(columns={'kcls_std': date}, inplace=True)
-        oneday_list.append(oneday_labeled)
+    for date, oneday_labeled in zip(date_list, cluster_days(quarter_table, collections_features, tensor,
+                                                            quarter_labels, warm_start, n_jobs, approximate,
+                                                            k_search)):
+        if accumulator is not None:
+            accumulator.add_day(oneday_labeled, 'kcls_std')
+        if keep_labels:
+            oneday_labeled.rename(columns={'kcls_std': date}, inplace=True)
+            oneday_list.append(oneday_labeled)
+    if not keep_labels:
+        return None, n_dates
     quarter_labeled = reduce(lambda left, right: pd.merge(left, right, on=['COMUNE', 'collection'], how='outer'),
                              oneday_list)
     quarter_labeled = quarter_labeled.set_index(['COMUNE', 'collection']).reset_index()  # To be reset
@@ -100,48 +238,232 @@ def cluster_quarter(quarter_table: pd.DataFrame, collections_features: dict):
 # FrequencySameCluster
 
 
-def frequency_collection(collection_labeled: pd.DataFrame, n_dates: int):
+def frequency_collection(collection_labeled: pd.DataFrame, n_dates: int, mode='dense', min_count=0,
+                         memory_budget=2 ** 28):
     """
     Calculate the similarity of each city and every other city in the dataset
     by the frequency (days) each city pair is classified in the same cluster
     in a quarter.
+    mode='dense' keeps the condensed counts of every city pair, mode='sparse' keeps
+    only the city pairs sharing a cluster, dropping those on fewer than min_count days,
+    mode='blocked' computes the counts by blocks of reference cities within memory_budget
+    bytes into a memory-mapped matrix.
     """
+    assert mode in ['dense', 'sparse', 'blocked'], f"{mode} is not a valid similarity mode."
     collection_labeled = collection_labeled.reset_index(drop=True)
-    cities = list(collection_labeled.COMUNE.unique())
-    similarity_dict = similarity.similar_cities_dict(collection_labeled)
-    collection_freq = similarity.cities_similarity_df(cities, similarity_dict, n_dates)
-    return collection_freq
+    if mode == 'sparse':
+        collection_similarity = similarity.similar_cities_sparse(collection_labeled, n_dates, min_count)
+    elif mode == 'blocked':
+        collection_similarity = similarity.similar_cities_blocked(collection_labeled, n_dates, memory_budget)
+    else:
+        collection_similarity = similarity.similar_cities_condensed(collection_labeled, n_dates)
+    return collection_similarity
 
 
-def frequency_to_dict(collection_freq, col: str, q: str, year: str):
+def frequency_to_dict_chunks(collection_similarity, col: str, q: str, year: str, memory_budget=2 ** 28):
     """
+    For each chunk of reference cities of the similarity, sized to build the records within memory_budget bytes:
+    -Expand similarity to a Frequency Dataframe;
     -Add reference columns;
     -Convert DataFrame to dictionary organized as records.
     """
-    collection_freq['ref_collection'] = col
-    collection_freq['ref_quarter'] = q
-    collection_freq['ref_year'] = year
-    collection_freq['_id'] = collection_freq[['city', 'ref_collection', 'ref_quarter',
-                                              'ref_year']].agg('_'.join, axis=1)
-    collection_freq = collection_freq.drop('city', axis=1)
-    frequency_dict = collection_freq.to_dict('records')
+    for collection_freq in collection_similarity.iter_frames(similarity.record_chunk_rows(memory_budget)):
+        if collection_freq.empty:
+            continue
+        collection_freq['ref_collection'] = col
+        collection_freq['ref_quarter'] = q
+        collection_freq['ref_year'] = year
+        collection_freq['_id'] = collection_freq[['city', 'ref_collection', 'ref_quarter',
+                                                  'ref_year']].agg('_'.join, axis=1)
+        collection_freq = collection_freq.drop('city', axis=1)
+        yield collection_freq.to_dict('records')
+
+
+def frequency_to_dict(collection_similarity, col: str, q: str, year: str):
+    """
+    Frequency dictionary per quarter for one collection, all chunks together.
+    """
+    frequency_dict = [record for chunk in frequency_to_dict_chunks(collection_similarity, col, q, year)
+                      for record in chunk]
     return frequency_dict
 
 
-def frequency_quarter(insert_collection, quarter_labeled: pd.DataFrame, n_dates: int, q: str, year: str):
+def neighbours_to_dict(collection_similarity, col: str, q: str, year: str, k: int):
+    """
+    -Rank the k most similar cities of each city;
+    -Convert to one dictionary per reference city with the ranked neighbours list.
+    """
+    neighbours, counts = similarity.top_k_neighbours(collection_similarity, k)
+    perc_sim = np.round((counts / collection_similarity.n_dates) * 100, 2)
+    names = [city.replace(' ', '_') for city in collection_similarity.cities]
+    neighbours_dict = []
+    for i, ref_city in enumerate(names):
+        neighbours_dict.append({'_id': '_'.join([ref_city, col, q, year]),
+                                'ref_COMUNE': ref_city,
+                                'ref_collection': col,
+                                'ref_quarter': q,
+                                'ref_year': year,
+                                'neighbours': [{'COMUNE': names[j], 'perc_sim': float(p)}
+                                               for j, p in zip(neighbours[i], perc_sim[i])]})
+    return neighbours_dict
+
+
+def packed_to_dict(collection_similarity, col: str, q: str, year: str):
+    """
+    Pack the similarity of one collection per quarter to a single dictionary:
+    -City index list;
+    -Condensed upper triangle counts as little-endian uint8 (or uint16) BSON Binary;
+    -Number of days, perc_sim = round(counts / n_dates * 100, 2).
+    """
+    condensed = collection_similarity.to_condensed()
+    dtype = '<u1' if condensed.max(initial=0) <= np.iinfo(np.uint8).max else '<u2'
+    packed_dict = {'_id': '_'.join([col, q, year]),
+                   'ref_collection': col,
+                   'ref_quarter': q,
+                   'ref_year': year,
+                   'cities': [city.replace(' ', '_') for city in collection_similarity.cities],
+                   'n_dates': int(collection_similarity.n_dates),
+                   'dtype': dtype,
+                   'counts': Binary(condensed.astype(dtype).tobytes())}
+    return packed_dict
+
+
+def collection_documents(collection_similarity, col: str, q: str, year: str, counts_directory=None,
+                         neighbours=False, k=10, storage='records', memory_budget=2 ** 28):
+    """
+    -Save the count matrix for rollups, if counts_directory is given;
+    -Build the frequency dictionary chunks (storage='records') or the single packed similarity
+    dictionary (storage='packed');
+    -Build the top k most similar cities dictionary, if neighbours is True.
+    """
+    assert storage in ['records', 'packed'], f"{storage} is not a valid storage format."
+    if counts_directory is not None:
+        similarity.save_counts(counts_directory, collection_similarity, col, q, year)
+    if storage == 'packed':
+        frequency_chunks = [[packed_to_dict(collection_similarity, col, q, year)]]
+    else:
+        frequency_chunks = frequency_to_dict_chunks(collection_similarity, col, q, year, memory_budget)
+    neighbours_dict = neighbours_to_dict(collection_similarity, col, q, year, k) if neighbours else None
+    return frequency_chunks, neighbours_dict
+
+
+def insert_documents(insert_collection, frequency_chunks, neighbours_collection=None, neighbours_dict=None):
+    """
+    Insert to MongoDB the frequency dictionary chunk by chunk and the top k most similar
+    cities dictionary, if neighbours_collection is given.
+    """
+    ack = 1
+    for frequency_dict in frequency_chunks:
+        ack = ack * database_utils.try_mongo_insert(frequency_dict, insert_collection)
+    if neighbours_collection is not None:
+        ack = ack * database_utils.try_mongo_insert(neighbours_dict, neighbours_collection)
+    return ack
+
+
+def upload_collection(insert_collection, collection_similarity, col: str, q: str, year: str, counts_directory=None,
+                      neighbours_collection=None, k=10, storage='records', memory_budget=2 ** 28):
+    """
+    -Save the count matrix for rollups, if counts_directory is given;
+    -Insert to MongoDB the frequency dictionary chunk by chunk, built within memory_budget bytes (storage='records')
+    or the single packed similarity dictionary (storage='packed');
+    -Insert the top k most similar cities dictionary to MongoDB, if neighbours_collection is given.
+    """
+    frequency_chunks, neighbours_dict = collection_documents(collection_similarity, col, q, year, counts_directory,
+                                                             neighbours_collection is not None, k, storage,
+                                                             memory_budget)
+    return insert_documents(insert_collection, frequency_chunks, neighbours_collection, neighbours_dict)
+
+
+def worker_collection_similarity(collection_labeled: pd.DataFrame, n_dates: int, mode: str, min_count: int,
+                                 memory_budget: int, col: str, q: str, year: str, counts_directory, neighbours: bool,
+                                 k: int):
+    """
+    Worker process task of one collection: similarity, counts file and top k most similar cities dictionary
+    of collection_documents. The similarity counts are sent back to build the frequency dictionaries.
+    """
+    collection_similarity = frequency_collection(collection_labeled, n_dates, mode, min_count, memory_budget)
+    if counts_directory is not None:
+        similarity.save_counts(counts_directory, collection_similarity, col, q, year)
+    neighbours_dict = neighbours_to_dict(collection_similarity, col, q, year, k) if neighbours else None
+    return collection_similarity, neighbours_dict
+
+
+def thread_insert_collection(insert_collection, collection_similarity, col: str, q: str, year: str,
+                             neighbours_collection=None, neighbours_dict=None, storage='records',
+                             memory_budget=2 ** 28):
+    """
+    Thread task of one collection: build the frequency dictionary chunks within memory_budget bytes
+    and insert them to MongoDB with the top k most similar cities dictionary, as upload_collection.
+    """
+    frequency_chunks, _ = collection_documents(collection_similarity, col, q, year, storage=storage,
+                                               memory_budget=memory_budget)
+    return insert_documents(insert_collection, frequency_chunks, neighbours_collection, neighbours_dict)
+
+
+def collection_similarities(quarter_labeled: pd.DataFrame, n_dates: int, mode='dense', min_count=0,
+                            memory_budget=2 ** 28):
+    """
+    Calculate the similarity of each collection group, in collection order.
+    """
+    for col in quarter_labeled.collection.unique():
+        yield col, frequency_collection(quarter_labeled[quarter_labeled.collection == col], n_dates, mode,
+                                        min_count, memory_budget)
+
+
+def frequency_quarter(insert_collection, quarter_labeled: pd.DataFrame, n_dates: int, q: str, year: str,
+                      mode='dense', min_count=0, counts_directory=None, neighbours_collection=None, k=10,
+                      memory_budget=2 ** 28, n_jobs=1, storage='records'):
     """
     For each collection group calculate the similarity of each city and every
     other city in the dataset by the frequency (days) each city pair is
     classified in the same cluster in a quarter.
+    With counts_directory the quarterly count matrices are saved for rollups,
+    with neighbours_collection the k most similar cities of each city are uploaded,
+    with n_jobs > 1 each collection similarity, counts file and top k most similar cities are computed in a
+    worker process, then its frequency dictionaries are built chunk by chunk and inserted in a thread of its own,
+    with storage='packed' each collection is uploaded as a single packed document,
+    memory_budget bounds the frequency records built at once (and the blocked mode similarity computation).
     """
-
+    assert storage in ['records', 'packed'], f"{storage} is not a valid storage format."
+    assert n_jobs == 1 or mode != 'blocked', 'Blocked similarity mode runs in a single process.'
+    if n_jobs == 1:
+        quarter_list = []
+        for col, collection_similarity in collection_similarities(quarter_labeled, n_dates, mode, min_count,
+                                                                  memory_budget):
+            ack = upload_collection(insert_collection, collection_similarity, col, q, year, counts_directory,
+                                    neighbours_collection, k, storage, memory_budget)
+            quarter_list.append(ack)
+        return quarter_list
     cols = list(quarter_labeled.collection.unique())
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(cols))) as processes, \
+            ThreadPoolExecutor(max_workers=len(cols)) as threads:
+        similarities = {processes.submit(worker_collection_similarity,
+                                         quarter_labeled[quarter_labeled.collection == col], n_dates, mode, min_count,
+                                         memory_budget, col, q, year, counts_directory,
+                                         neighbours_collection is not None, k): col for col in cols}
+        uploads = {}
+        for future in as_completed(similarities):
+            collection_similarity, neighbours_dict = future.result()
+            col = similarities[future]
+            # MongoClient is thread-safe, the inserts of every thread share its connection pool.
+            uploads[col] = threads.submit(thread_insert_collection, insert_collection, collection_similarity, col, q,
+                                          year, neighbours_collection, neighbours_dict, storage, memory_budget)
+        quarter_list = [uploads[col].result() for col in cols]
+    return quarter_list
+
+
+def frequency_accumulated(insert_collection, accumulator, q: str, year: str, counts_directory=None,
+                          neighbours_collection=None, k=10, storage='records', memory_budget=2 ** 28):
+    """
+    For each collection group upload the similarity of each city and every
+    other city in the dataset counted by the accumulator while clustering the quarter,
+    the frequency records built within memory_budget bytes at once.
+    """
     quarter_list = []
-    for col in cols:
-        collection_labeled = quarter_labeled[quarter_labeled.collection == col]
-        collection_freq = frequency_collection(collection_labeled, n_dates)
-        frequency_dict = frequency_to_dict(collection_freq, col, q, year)
-        ack = database_utils.try_mongo_insert(frequency_dict, insert_collection)
+    for col in accumulator.counts:
+        collection_similarity = accumulator.similarity(col)
+        ack = upload_collection(insert_collection, collection_similarity, col, q, year, counts_directory,
+                                neighbours_collection, k, storage, memory_budget)
         quarter_list.append(ack)
     return quarter_list
 
@@ -150,25 +472,74 @@ def select_quarter(shape_table: pd.DataFrame, quarter: dict, q: str):
     """
     Filter rows from one quarter.
     """
-    row_list = []
-    for i, row in shape_table.iterrows():
-        if row['data'][5:7] in quarter[q]:
-            row_list.append(i)
-    quarter_table = shape_table.iloc[row_list]
+    quarter_table = shape_table[shape_table['data'].str[5:7].isin(quarter[q])]
     return quarter_table
 
 
-def frequency_year(shape_table: pd.DataFrame, collections_features: dict, quarter: dict, year: str, insert_collection):
+def partition_quarters(shape_table: pd.DataFrame, quarter: dict) -> dict:
+    """
+    Split the year Dataframe by quarter in a single pass:
+    -Map the month of each date to its quarter;
+    -Sort the rows by quarter once (stable, the rows keep their order within a quarter);
+    -Slice the rows of each quarter, a view of the sorted table.
+    Rows of months in no quarter are dropped.
+
+    Returns
+    ----------
+    quarter_tables: Dictionary with the Dataframe of each quarter, in quarter order.
+    """
+    month_quarter = {month: position for position, months in enumerate(quarter.values()) for month in months}
+    quarter_codes = shape_table['data'].str[5:7].map(month_quarter).fillna(len(quarter)).to_numpy(dtype=np.intp)
+    order = np.argsort(quarter_codes, kind='stable')
+    bounds = np.searchsorted(quarter_codes[order], np.arange(len(quarter) + 1))
+    sorted_table = shape_table.iloc[order]
+    quarter_tables = {q: sorted_table.iloc[bounds[position]:bounds[position + 1]]
+                      for position, q in enumerate(quarter)}
+    return quarter_tables
+
+
+def frequency_year(shape_table: pd.DataFrame, collections_features: dict, quarter: dict, year: str, insert_collection,
+                   streaming=False, counts_directory=None, neighbours_collection=None, n_jobs=1,
+                   storage='records', warm_start=None, engine='sklearn', approximate=None, k_search=None,
+                   approximate_deviations=None):
     """
     For each quarter in a year calculate the similarity of each city
     and every other city in the dataset by the frequency (days) each
     city pair is classified in the same cluster in the quarter.
+    With streaming the similarity is counted day by day while clustering
+    and the labeled quarter is never assembled.
+    With counts_directory the quarterly count matrices are saved for rollups,
+    with neighbours_collection the most similar cities of each city are uploaded,
+    n_jobs is the number of worker processes clustering the dates (sequential with warm_start)
+    and computing the similarities, storage the frequency documents format,
+    warm_start a cluster_utils.KmeansWarmStart carried across the days of the year,
+    engine the Kmeans engine, approximate the approximate mode settings and k_search the adaptive
+    number of clusters search of cluster_quarter. approximate_deviations is filled with the deviation
+    of the approximate mode of each quarter {q: deviation}, see cluster_quarter.
     """
+    day_jobs = n_jobs if warm_start is None else 1
     q_list = ['q1', 'q2', 'q3', 'q4']
+    quarter_tables = partition_quarters(shape_table, quarter)
     year_list = []
     for q in q_list:
-        quarter_table = select_quarter(shape_table, quarter, q)
-        quarter_labeled, n_dates = cluster_quarter(quarter_table, collections_features)
-        quarter_list = frequency_quarter(insert_collection, quarter_labeled, n_dates, q, year)
+        quarter_table = quarter_tables[q]
+        deviation = {} if approximate_deviations is not None else None
+        if streaming:
+            accumulator = similarity.CoAssociationAccumulator(quarter_table.COMUNE.unique())
+            cluster_quarter(quarter_table, collections_features, accumulator, keep_labels=False,
+                            warm_start=warm_start, engine=engine, n_jobs=day_jobs, approximate=approximate,
+                            k_search=k_search, deviation=deviation)
+            quarter_list = frequency_accumulated(insert_collection, accumulator, q, year, counts_directory,
+                                                 neighbours_collection, storage=storage)
+        else:
+            quarter_labeled, n_dates = cluster_quarter(quarter_table, collections_features, warm_start=warm_start,
+                                                       engine=engine, n_jobs=day_jobs, approximate=approximate,
+                                                       k_search=k_search, deviation=deviation)
+            quarter_list = frequency_quarter(insert_collection, quarter_labeled, n_dates, q, year,
+                                             counts_directory=counts_directory,
+                                             neighbours_collection=neighbours_collection, n_jobs=n_jobs,
+                                             storage=storage)
+        if deviation:
+            approximate_deviations[q] = deviation
         year_list.append(quarter_list)
     return year_list
@@ -1,10 +1,53 @@
+from utils import cluster_utils
 import execute
+import rollup
 
 
-def frequency_by_quarter_calculator(import_client, insert_collection, region_shape, years):
+def frequency_by_quarter_calculator(import_client, insert_collection, region_shape, years, streaming=False,
+                                    counts_directory=None, neighbours_collection=None, n_jobs=1, storage='records',
+                                    warm_start=False, engine='sklearn', approximate=False, sample_size=1000,
+                                    random_state=0, k_search=None, k_search_counters=None,
+                                    warm_start_counters=None, approximate_deviations=None):
     """
-    
+    -Import data from Mongo DB collections for each year;
+    -Assign latitude and longitude coordinates to municipalities;
+    -Fit Kmeans models for each day of the quarter and select the number of clusters by the silhouette score;
+    -Calculate the similarity of each city and every other city in the dataset, by the frequency (days)
+    each city pair is classified in the same cluster in the quarter;
+    -Save Kmeans frequency results to MongoDB.
+
+    Parameters
+    ----------
+    import_client: MongoDB client credentials for input;
+    insert_collection: MongoDB collection for Kmeans frequency results output;
+    region_shape: Municipalities GeoDataFrame of the region;
+    years: List of years;
+    streaming: Count the city pair similarity day by day while clustering the quarter;
+    counts_directory: Directory where the quarterly count matrices are saved for rollups, None to skip;
+    neighbours_collection: MongoDB collection for the top k most similar cities, None to skip;
+    n_jobs: Number of worker processes clustering the dates (sequential with warm_start) and computing
+    the similarities;
+    storage: Frequency documents format, 'records' one per city pair or 'packed' one per collection;
+    warm_start: Warm start each day's Kmeans fits from the previous day's centroids (cluster_utils.KmeansWarmStart);
+    engine: Kmeans engine, 'sklearn' or 'batched' (every date and number of clusters of a quarter at once,
+    without warm_start, approximate and k_search);
+    approximate: MiniBatchKMeans fits and silhouette scores on a sample of cities (cluster_utils.KmeansApproximate);
+    sample_size: approximate only, number of cities sampled for the silhouette scores;
+    random_state: approximate only, seed of the sample and of the MiniBatchKMeans fits;
+    k_search: Adaptive number of clusters search strategy of cluster_utils.AdaptiveKSearch,
+    'patience' or 'coarse', None to evaluate every number of clusters;
+    k_search_counters: Dictionary filled with the AdaptiveKSearch counters of the whole run and, under 'days',
+    of each date {date: counters} (numbers of clusters 'evaluated' per date), None to skip;
+    warm_start_counters: Dictionary filled with the KmeansWarmStart counters, None to skip;
+    approximate_deviations: approximate only, dictionary filled with the deviation of the approximate mode
+    from the exact one of every (year, quarter), see cluster_utils.approximate_deviation. An exact sweep
+    of every date is run on top of the clustering. None to skip.
+
+    Returns
+    ----------
+    n_errors: Frequency upload error count.
     """
+    assert storage in ['records', 'packed'], f"{storage} is not a valid storage format."
     import_database = 'copernicus_datastore'
     collections = {'atmosphere_data': False, 'climate_data_old': True}
     quarter = {'q1': [f'{i:>02}' for i in range(1, 4)],
@@ -12,11 +55,36 @@ def frequency_by_quarter_calculator(import_client, insert_collection, region_sha
                'q3': [f'{i:>02}' for i in range(7, 10)],
                'q4': [f'{i:>02}' for i in range(10, 13)]}
     n_errors_list = []
+    kmeans_warm_start = cluster_utils.KmeansWarmStart() if warm_start else None
+    kmeans_approximate = None
+    if approximate:
+        kmeans_approximate = cluster_utils.KmeansApproximate(sample_size, random_state=random_state)
+    kmeans_k_search = cluster_utils.AdaptiveKSearch(k_search) if k_search is not None else None
     for year in years:
+        year_deviations = {} if approximate_deviations is not None else None
         shape_table, collections_features = execute.create_tables(import_client, import_database, collections, year,
                                                                   region_shape)
         insert_success_list = execute.frequency_year(shape_table, collections_features, quarter, year,
-                                                     insert_collection)
+                                                     insert_collection, streaming, counts_directory,
+                                                     neighbours_collection, n_jobs, storage, kmeans_warm_start,
+                                                     engine, kmeans_approximate, kmeans_k_search, year_deviations)
         n_errors_list.append(insert_success_list)
+        if year_deviations:
+            approximate_deviations.update({(year, q): deviation for q, deviation in year_deviations.items()})
+    if kmeans_warm_start is not None and warm_start_counters is not None:
+        warm_start_counters.update(kmeans_warm_start.counters)
+    if kmeans_k_search is not None and k_search_counters is not None:
+        k_search_counters.update(kmeans_k_search.counters, days=kmeans_k_search.days)
     n_errors = len(n_errors_list) - sum(n_errors_list)
     return n_errors
+
+
+def frequency_rollup_calculator(insert_collection, counts_directory, periods,
+                                cols=('atmosphere_data_climate_data_old', 'atmosphere_data', 'climate_data_old')):
+    """
+    Sum the quarterly count matrices saved by frequency_by_quarter_calculator
+    over a set of (year, quarter) periods and upload the rolled up similarity.
+    """
+    rollup_list = rollup.frequency_rollup(insert_collection, counts_directory, list(cols), periods)
+    n_errors = len(rollup_list) - sum(rollup_list)
+    return n_errors
@@ -1,72 +1,654 @@
+import numpy as np
 import pandas as pd
+import os
+import tempfile
 from pandas import DataFrame
+from scipy import sparse
+from scipy.linalg import blas
 
+# Approximate memory of one frequency record while it is built, Dataframe row plus records dictionary.
+RECORD_BYTES = 512
 
-def similarity_counter(dataframe: pd.DataFrame):
+
+def labels_to_codes(labeled_time: pd.DataFrame):
     """
-    Count number of occurrences: Two columns in a dataframe
-    have equal values.
+    Convert the labeled quarter to an integer label matrix.
+    Every column after COMUNE is factorized on its own, missing labels are coded as -1.
+
+    Parameters
+    ----------
+    labeled_time: Quarter Dataframe with COMUNE as first column followed by the clustering labels.
+
+    Returns
+    ----------
+    cities: List of cities, one per row of codes;
+    codes: np.Array (cities x columns) with the integer label codes.
     """
-    values = []
-    for i, row in dataframe.iterrows():
-        if row[0] == row[1]:
-            values.append(True)
-        else:
-            values.append(False)
-    return values.count(True)
+    cities = labeled_time.COMUNE.tolist()
+    columns = labeled_time.columns[1:]
+    codes = np.empty((len(cities), len(columns)), dtype=np.int64)
+    for j, column in enumerate(columns):
+        codes[:, j] = pd.factorize(labeled_time[column])[0]
+    return cities, codes
 
 
-def similar_cities_dict(labeled_time: pd.DataFrame):
+def indicator_positions(codes: np.ndarray):
     """
-    Create dictionary with the number of days each city
-    is classified in the same cluster as every other 
-    city in the dataset in the same quarter.
+    Row and column positions of the ones when the codes of every column are one-hot
+    encoded side by side, missing codes (-1) are left empty.
+
+    Returns
+    ----------
+    rows: Row position of each one;
+    cols: Column position of each one;
+    width: Total number of indicator columns.
+    """
+    widths = codes.max(axis=0) + 1
+    offsets = np.concatenate([[0], np.cumsum(widths)[:-1]])
+    valid = codes >= 0
+    return np.nonzero(valid)[0], (codes + offsets)[valid], widths.sum()
+
+
+def indicator_matrix(codes: np.ndarray) -> np.ndarray:
+    """
+    Dense one-hot indicator matrix (cities x codes of all columns).
+    """
+    rows, cols, width = indicator_positions(codes)
+    indicator = np.zeros((codes.shape[0], width), dtype=np.float32, order='F')
+    indicator[rows, cols] = 1
+    return indicator
+
+
+def sparse_indicator_matrix(codes: np.ndarray) -> sparse.csr_matrix:
+    """
+    Sparse one-hot indicator matrix (cities x codes of all columns).
+    """
+    rows, cols, width = indicator_positions(codes)
+    indicator = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                  shape=(codes.shape[0], width))
+    return indicator
+
+
+def co_association_matrix(codes: np.ndarray) -> np.ndarray:
+    """
+    Count for every pair of rows the number of columns in which both rows have the same code.
+    Each column code is one-hot encoded, the counts are the product of the indicator matrix
+    with its transpose. Missing codes (-1) never match.
+
+    Parameters
+    ----------
+    codes: np.Array (cities x columns) with the integer label codes.
+
+    Returns
+    ----------
+    counts: np.Array (cities x cities) with the number of matching columns.
+    """
+    indicator = indicator_matrix(codes)
+    counts = (indicator @ indicator.T).astype(np.int64)
+    return counts
+
+
+def record_chunk_rows(memory_budget: int) -> int:
+    """
+    Number of frequency records (ordered city pairs) built at once within memory_budget bytes.
+    """
+    return int(max(1, memory_budget // RECORD_BYTES))
+
+
+def reference_blocks(n_cities: int, chunk_rows=None):
+    """
+    Consecutive blocks of reference cities with at most chunk_rows ordered city pairs each
+    (at least one reference city per block), a single block when chunk_rows is None.
+
+    Returns
+    ----------
+    Generator of (start, stop) reference cities positions.
+    """
+    block_rows = n_cities if chunk_rows is None else max(1, chunk_rows // max(n_cities - 1, 1))
+    for start in range(0, n_cities, block_rows):
+        yield start, min(start + block_rows, n_cities)
+
+
+def condensed_index(n_cities: int, i, j):
+    """
+    Position of the pair (i, j), i != j, in the condensed upper triangle
+    (scipy.spatial.distance.squareform order). Accepts integers or integer arrays.
+    """
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    return n_cities * i - i * (i + 1) // 2 + j - i - 1
+
+
+def condensed_to_matrix(condensed: np.ndarray, n_cities: int) -> np.ndarray:
     """
-    df = labeled_time
-    similarity_dict = {}
-    for i, row in df.iterrows():
-        ref_city = df.iloc[i, 0]
-        city_list = df[df.columns[0]].tolist()
-        city_list.remove(ref_city)
-        city_dict = {}
-        for city in city_list:
-            two_df = df[(df.COMUNE == ref_city) | (df.COMUNE == city)]
-            t_two_df = two_df.transpose()
-            t_two_df.columns = t_two_df.iloc[0]
-            t_two_df = t_two_df.iloc[1:]
-            city_dict[city] = similarity_counter(t_two_df)
-        similarity_dict[ref_city] = city_dict
-    return similarity_dict   
-    
-                                           
-def cities_dict_to_df(city: str, similarity_dict: dict, n_dates: int):
-    """
-    Create dataframe with the percentual of days each city
-    is classified in the same cluster as every other 
+    Expand condensed upper triangle counts to the square (cities x cities) matrix, zero diagonal.
+    Copied row by row, no pair index arrays.
+    """
+    matrix = np.zeros((n_cities, n_cities), dtype=condensed.dtype)
+    start = 0
+    for i in range(n_cities - 1):
+        stop = start + n_cities - i - 1
+        matrix[i, i + 1:] = condensed[start:stop]
+        matrix[i + 1:, i] = condensed[start:stop]
+        start = stop
+    return matrix
+
+
+def upper_to_condensed(upper: np.ndarray, dtype=np.uint16) -> np.ndarray:
+    """
+    Strict upper triangle of a square matrix as condensed counts, copied row by row
+    into a preallocated buffer, no pair index arrays.
+    """
+    n_cities = upper.shape[0]
+    condensed = np.empty(n_cities * (n_cities - 1) // 2, dtype=dtype)
+    start = 0
+    for i in range(n_cities - 1):
+        stop = start + n_cities - i - 1
+        condensed[start:stop] = upper[i, i + 1:]
+        start = stop
+    return condensed
+
+
+def co_association_condensed(codes: np.ndarray) -> np.ndarray:
+    """
+    Same counts as co_association_matrix, computing only the upper triangle (float32 n x n, BLAS syrk)
+    and keeping it as uint16 condensed counts.
+
+    Parameters
+    ----------
+    codes: np.Array (cities x columns) with the integer label codes.
+
+    Returns
+    ----------
+    condensed: uint16 np.Array of length n*(n-1)/2 with the number of matching columns per city pair.
+    """
+    assert codes.shape[1] <= np.iinfo(np.uint16).max, 'Too many columns for uint16 counts.'
+    indicator = indicator_matrix(codes)
+    upper = blas.ssyrk(1.0, indicator)
+    condensed = upper_to_condensed(upper)
+    return condensed
+
+
+class CondensedSimilarity:
+    """
+    Symmetric number of days each city pair is classified in the same cluster,
+    stored once per pair as the condensed upper triangle.
+
+    Attributes
+    ----------
+    cities: List of cities;
+    index: Dictionary city -> position in cities;
+    counts: uint16 np.Array with the condensed counts;
+    n_dates: length of the period in days.
+    """
+
+    def __init__(self, cities: list, counts: np.ndarray, n_dates: int):
+        self.cities = list(cities)
+        self.index = {city: i for i, city in enumerate(self.cities)}
+        self.counts = counts
+        self.n_dates = n_dates
+
+    def count(self, ref_city: str, city: str) -> int:
+        """
+        Number of days ref_city and city are classified in the same cluster.
+        """
+        i, j = self.index[ref_city], self.index[city]
+        return int(self.counts[condensed_index(len(self.cities), i, j)])
+
+    def perc_sim(self, ref_city: str, city: str) -> float:
+        """
+        Percentual of days ref_city and city are classified in the same cluster.
+        """
+        return float(np.round((self.count(ref_city, city) / self.n_dates) * 100, 2))
+
+    def to_matrix(self) -> np.ndarray:
+        """
+        Expand the condensed counts to the square (cities x cities) matrix, zero diagonal.
+        """
+        return condensed_to_matrix(self.counts, len(self.cities))
+
+    def to_condensed(self) -> np.ndarray:
+        """
+        Condensed upper triangle counts.
+        """
+        return self.counts
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Long format Dataframe with one row per ordered city pair.
+        """
+        return cities_similarity_df(self.cities, self.counts, self.n_dates)
+
+    def iter_frames(self, chunk_rows=None):
+        """
+        Long format Dataframe by blocks of reference cities of at most chunk_rows rows,
+        in a single chunk when chunk_rows is None.
+        """
+        n_cities = len(self.cities)
+        for start, stop in reference_blocks(n_cities, chunk_rows):
+            ref_index, index = np.nonzero(np.arange(start, stop)[:, None] != np.arange(n_cities))
+            counts = self.counts[condensed_index(n_cities, ref_index + start, index)]
+            yield pairs_similarity_df(self.cities, ref_index + start, index, counts, self.n_dates)
+
+
+class CoAssociationAccumulator:
+    """
+    Running number of days each city pair is classified in the same cluster,
+    one condensed counter per collection, fed one day of labels at a time.
+
+    Attributes
+    ----------
+    cities: List of all cities in the quarter;
+    index: Dictionary city -> position in cities;
+    counts: Dictionary collection -> uint16 np.Array with the condensed counts;
+    n_dates: Number of days accumulated so far.
+    """
+
+    def __init__(self, cities: list):
+        self.cities = list(cities)
+        self.index = {city: i for i, city in enumerate(self.cities)}
+        self.counts = {}
+        self.n_dates = 0
+
+    def add_labels(self, collection: str, cities: list, labels):
+        """
+        Add one day of labels for one collection. Cities without labels never match.
+        """
+        codes = np.full((len(self.cities), 1), -1, dtype=np.int64)
+        codes[[self.index[city] for city in cities], 0] = pd.factorize(labels)[0]
+        if collection not in self.counts:
+            # frequency_collection compares the constant collection column along with the days,
+            # every city pair starts with one match.
+            self.counts[collection] = co_association_condensed(np.zeros_like(codes))
+        self.counts[collection] += co_association_condensed(codes)
+
+    def add_day(self, oneday_labeled: pd.DataFrame, label_column: str):
+        """
+        Add the labels of all collections for a single day.
+
+        Parameters
+        ----------
+        oneday_labeled: Single day Dataframe with COMUNE, collection and the label column;
+        label_column: Name of the clustering labels column.
+        """
+        for collection, labeled in oneday_labeled.groupby('collection', sort=False):
+            self.add_labels(collection, labeled.COMUNE.tolist(), labeled[label_column])
+        self.n_dates += 1
+
+    def similarity(self, collection: str) -> CondensedSimilarity:
+        """
+        Condensed similarity of one collection over the days accumulated so far.
+        """
+        return CondensedSimilarity(self.cities, self.counts[collection].copy(), self.n_dates)
+
+
+def sparse_co_association(codes: np.ndarray, min_count=0):
+    """
+    Same counts as co_association_matrix as a sparse upper triangle.
+    Columns where all rows share the same code add the same count to every pair,
+    they are kept apart as a single base count instead of filling the matrix.
+    The other columns are one-hot encoded as sparse city x cluster indicators
+    and the pair counts are accumulated as a sparse product.
+
+    Parameters
+    ----------
+    codes: np.Array (cities x columns) with the integer label codes;
+    min_count: Pairs with fewer matching columns are dropped.
+
+    Returns
+    ----------
+    counts: scipy.sparse CSR upper triangle with the number of matching columns of the pairs
+    that share a code in at least one of the varying columns, base included;
+    base: Number of matching columns shared by every pair.
+    """
+    uniform = (codes == codes[:1]).all(axis=0) & (codes[0] >= 0)
+    base = int(uniform.sum())
+    varying = codes[:, ~uniform]
+    if varying.shape[1]:
+        indicator = sparse_indicator_matrix(varying)
+        counts = sparse.triu(indicator @ indicator.T, k=1, format='csr')
+    else:
+        counts = sparse.csr_matrix((codes.shape[0], codes.shape[0]), dtype=np.int32)
+    counts.data += base
+    counts.data[counts.data < min_count] = 0
+    counts.eliminate_zeros()
+    return counts, base
+
+
+class SparseSimilarity:
+    """
+    Number of days each city pair is classified in the same cluster, stored as a
+    sparse upper triangle holding only the pairs reaching min_count.
+    The frames and the top k neighbours are computed from the stored pairs, by blocks of reference
+    cities. When every pair reaches min_count (base >= min_count, e.g. min_count=0) the frames hold
+    every city pair all the same. to_condensed (count files, packed documents) is the condensed
+    format itself, n*(n-1)/2 uint16, and to_matrix the square matrix.
+
+    Attributes
+    ----------
+    cities: List of cities;
+    index: Dictionary city -> position in cities;
+    counts: scipy.sparse CSR upper triangle with the pair counts;
+    base: Count of the pairs not stored in counts before the min_count floor;
+    min_count: Pairs with fewer days in the same cluster are dropped;
+    n_dates: length of the period in days.
+    """
+
+    def __init__(self, cities: list, counts: sparse.csr_matrix, base: int, min_count: int, n_dates: int):
+        self.cities = list(cities)
+        self.index = {city: i for i, city in enumerate(self.cities)}
+        self.counts = counts
+        self.base = base
+        self.min_count = min_count
+        self.n_dates = n_dates
+
+    @property
+    def fill(self) -> int:
+        """
+        Count of the pairs not stored in counts, 0 if dropped by the min_count floor.
+        """
+        return self.base if self.base >= self.min_count else 0
+
+    def count(self, ref_city: str, city: str) -> int:
+        """
+        Number of days ref_city and city are classified in the same cluster, 0 if dropped.
+        """
+        i, j = sorted((self.index[ref_city], self.index[city]))
+        row = self.counts.getrow(i)
+        stored = row.data[row.indices == j]
+        return int(stored[0]) if len(stored) else self.fill
+
+    def perc_sim(self, ref_city: str, city: str) -> float:
+        """
+        Percentual of days ref_city and city are classified in the same cluster, 0 if dropped.
+        """
+        return float(np.round((self.count(ref_city, city) / self.n_dates) * 100, 2))
+
+    def to_condensed(self) -> np.ndarray:
+        """
+        Expand the sparse counts to the condensed upper triangle.
+        """
+        n_cities = len(self.cities)
+        condensed = np.full(n_cities * (n_cities - 1) // 2, self.fill, dtype=np.uint16)
+        upper = self.counts.tocoo()
+        condensed[condensed_index(n_cities, upper.row, upper.col)] = upper.data
+        return condensed
+
+    def to_matrix(self) -> np.ndarray:
+        """
+        Expand the sparse counts to the square (cities x cities) matrix, zero diagonal.
+        """
+        return condensed_to_matrix(self.to_condensed(), len(self.cities))
+
+    def symmetric(self) -> sparse.csr_matrix:
+        """
+        Stored pair counts in both directions, sorted column indices in every row.
+        """
+        symmetric = (self.counts + self.counts.T).tocsr()
+        symmetric.sort_indices()
+        return symmetric
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Long format Dataframe with one row per ordered city pair reaching min_count.
+        """
+        return pd.concat(self.iter_frames(), ignore_index=True)
+
+    def top_k(self, k: int):
+        """
+        Most similar cities of every city as top_k_neighbours, from the stored pairs of each row.
+        Pairs not stored count fill, only the k lowest positions among them can be ranked.
+        """
+        n_cities = len(self.cities)
+        k = min(k, n_cities - 1)
+        symmetric = self.symmetric()
+        neighbours = np.empty((n_cities, k), dtype=np.int64)
+        counts = np.empty((n_cities, k), dtype=np.int64)
+        for i in range(n_cities):
+            stored = symmetric.indices[symmetric.indptr[i]:symmetric.indptr[i + 1]]
+            stored_counts = symmetric.data[symmetric.indptr[i]:symmetric.indptr[i + 1]]
+            candidates = np.arange(min(n_cities, k + len(stored) + 1))
+            others = candidates[~np.isin(candidates, stored) & (candidates != i)][:k]
+            index = np.concatenate([stored, others]).astype(np.int64)
+            row_counts = np.concatenate([stored_counts, np.full(len(others), self.fill)]).astype(np.int64)
+            order = np.lexsort((index, -row_counts))[:k]
+            neighbours[i], counts[i] = index[order], row_counts[order]
+        return neighbours, counts
+
+    def iter_frames(self, chunk_rows=None):
+        """
+        Long format Dataframe by blocks of reference cities of at most chunk_rows rows,
+        in a single chunk when chunk_rows is None. Only the rows of the pairs of a block are
+        expanded from the sparse counts.
+        """
+        n_cities = len(self.cities)
+        symmetric = self.symmetric()
+        for start, stop in reference_blocks(n_cities, chunk_rows):
+            if self.base >= self.min_count:
+                # Every pair reaches min_count, pairs not stored take the base count.
+                block = symmetric[start:stop].toarray()
+                block[block == 0] = self.fill
+                ref_index, index = np.nonzero(np.arange(start, stop)[:, None] != np.arange(n_cities))
+                counts = block[ref_index, index]
+            else:
+                block = symmetric[start:stop].tocoo()
+                ref_index, index, counts = block.row, block.col, block.data
+            yield pairs_similarity_df(self.cities, ref_index + start, index, counts, self.n_dates)
+
+
+def similar_cities_sparse(labeled_time: pd.DataFrame, n_dates: int, min_count=0) -> SparseSimilarity:
+    """
+    Create the sparse similarity with the number of days each city
+    is classified in the same cluster as every other
+    city in the dataset in the same quarter, dropping the pairs below min_count.
+    """
+    cities, codes = labels_to_codes(labeled_time)
+    counts, base = sparse_co_association(codes, min_count)
+    return SparseSimilarity(cities, counts, base, min_count, n_dates)
+
+
+class BlockedSimilarity:
+    """
+    Number of days each city pair is classified in the same cluster, stored as a
+    square uint16 matrix in a memory-mapped temporary file and computed by blocks
+    of reference cities so that the working memory stays within a budget.
+
+    Attributes
+    ----------
+    cities: List of cities;
+    index: Dictionary city -> position in cities;
+    counts: np.memmap (cities x cities) with the pair counts, zero diagonal;
+    block_rows: Number of reference cities per block of the counts computation;
+    memory_budget: Working memory in bytes, also bounds the frequency records built at once;
+    n_dates: length of the period in days.
+    """
+
+    def __init__(self, cities: list, codes: np.ndarray, n_dates: int, memory_budget: int, directory=None):
+        assert codes.shape[1] <= np.iinfo(np.uint16).max, 'Too many columns for uint16 counts.'
+        self.cities = list(cities)
+        self.index = {city: i for i, city in enumerate(self.cities)}
+        self.n_dates = n_dates
+        self.memory_budget = memory_budget
+        n_cities = len(self.cities)
+        indicator = np.ascontiguousarray(indicator_matrix(codes))
+        row_bytes = n_cities * (np.dtype(np.float32).itemsize + np.dtype(np.uint16).itemsize)
+        self.block_rows = int(max(1, (memory_budget - indicator.nbytes) // row_bytes))
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self.counts = np.memmap(self._file, dtype=np.uint16, mode='w+', shape=(n_cities, n_cities))
+        for start in range(0, n_cities, self.block_rows):
+            stop = min(start + self.block_rows, n_cities)
+            block = (indicator[start:stop] @ indicator.T).astype(np.uint16)
+            block[np.arange(stop - start), np.arange(start, stop)] = 0
+            self.counts[start:stop] = block
+        self.counts.flush()
+
+    def count(self, ref_city: str, city: str) -> int:
+        """
+        Number of days ref_city and city are classified in the same cluster.
+        """
+        return int(self.counts[self.index[ref_city], self.index[city]])
+
+    def perc_sim(self, ref_city: str, city: str) -> float:
+        """
+        Percentual of days ref_city and city are classified in the same cluster.
+        """
+        return float(np.round((self.count(ref_city, city) / self.n_dates) * 100, 2))
+
+    def to_matrix(self) -> np.memmap:
+        """
+        Square (cities x cities) memory-mapped matrix, zero diagonal.
+        """
+        return self.counts
+
+    def to_condensed(self) -> np.ndarray:
+        """
+        Condensed upper triangle counts, read by blocks of reference cities.
+        """
+        n_cities = len(self.cities)
+        blocks = [self.counts[i, i + 1:] for i in range(n_cities)]
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.uint16)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Long format Dataframe with one row per ordered city pair.
+        """
+        return pd.concat(self.iter_frames(), ignore_index=True)
+
+    def iter_frames(self, chunk_rows=None):
+        """
+        Long format Dataframe by blocks of reference cities of at most chunk_rows rows, read from the
+        memory-mapped matrix. chunk_rows defaults to the records that fit in memory_budget.
+        """
+        n_cities = len(self.cities)
+        if chunk_rows is None:
+            chunk_rows = record_chunk_rows(self.memory_budget)
+        for start, stop in reference_blocks(n_cities, chunk_rows):
+            ref_index, index = np.nonzero(np.arange(start, stop)[:, None] != np.arange(n_cities))
+            counts = self.counts[start:stop][ref_index, index]
+            yield pairs_similarity_df(self.cities, ref_index + start, index, counts, self.n_dates)
+
+
+def similar_cities_blocked(labeled_time: pd.DataFrame, n_dates: int, memory_budget=2 ** 28,
+                           directory=None) -> BlockedSimilarity:
+    """
+    Create the blocked similarity with the number of days each city
+    is classified in the same cluster as every other
+    city in the dataset in the same quarter, within memory_budget bytes,
+    memory-mapped to a temporary file in directory (system temporary directory if None).
+    """
+    cities, codes = labels_to_codes(labeled_time)
+    return BlockedSimilarity(cities, codes, n_dates, memory_budget, directory)
+
+
+def similar_cities_condensed(labeled_time: pd.DataFrame, n_dates: int) -> CondensedSimilarity:
+    """
+    Create the condensed similarity with the number of days each city
+    is classified in the same cluster as every other
     city in the dataset in the same quarter.
     """
-    city_dict = similarity_dict[city]
-    city_freq = pd.DataFrame.from_dict(city_dict, orient='index')
-    city_freq['COMUNE'] = city_freq.index
-    city_freq['COMUNE'] = city_freq['COMUNE'].str.replace(' ', '_')
-    city_freq['perc_sim'] = round((city_freq[0] / n_dates) * 100, 2)
-    city_freq = city_freq.drop(0, axis=1)
-    city_freq.reset_index(inplace=True)
-    city_freq = city_freq.iloc[:, 1:]
-    city_freq['ref_COMUNE'] = city.replace(' ', '_')
-    city_freq['city'] = city_freq[['COMUNE', 'ref_COMUNE']].agg('_'.join, axis=1)
-    return city_freq
+    cities, codes = labels_to_codes(labeled_time)
+    counts = co_association_condensed(codes)
+    return CondensedSimilarity(cities, counts, n_dates)
 
 
-def cities_similarity_df(cities: list, similarity_dict: dict, n_dates: int):
+def cities_similarity_df(cities: list, condensed: np.ndarray, n_dates: int):
     """
-    Create a dataframe for all cities in the dataset with the 
-    percentual of days each city is classified in the same cluster 
+    Create a dataframe for all cities in the dataset with the
+    percentual of days each city is classified in the same cluster
     as every other city in the dataset in the same quarter.
     """
-    city_list = []
-    for city in cities:
-        city_freq = cities_dict_to_df(city, similarity_dict, n_dates)
-        city_list.append(city_freq)
-    collection_freq = pd.concat(city_list)
+    n_cities = len(cities)
+    ref_index, index = np.nonzero(~np.eye(n_cities, dtype=bool))
+    counts = condensed[condensed_index(n_cities, ref_index, index)]
+    collection_freq = pairs_similarity_df(cities, ref_index, index, counts, n_dates)
     return collection_freq
+
+
+def pairs_similarity_df(cities: list, ref_index: np.ndarray, index: np.ndarray, counts: np.ndarray, n_dates: int):
+    """
+    Create a dataframe with the percentual of days each listed
+    (ref_COMUNE, COMUNE) pair is classified in the same cluster.
+    """
+    names = pd.Series(cities).str.replace(' ', '_').to_numpy()
+    collection_freq = pd.DataFrame({'COMUNE': names[index],
+                                    'perc_sim': np.round((counts / n_dates) * 100, 2),
+                                    'ref_COMUNE': names[ref_index]})
+    collection_freq['city'] = collection_freq['COMUNE'] + '_' + collection_freq['ref_COMUNE']
+    return collection_freq
+
+
+def top_k_neighbours(collection_similarity, k: int):
+    """
+    Most similar cities of every city, ranked by the number of days in the same cluster.
+    Ties are ranked by city position. argpartition selects the k largest counts of each row,
+    only those are sorted.
+
+    Parameters
+    ----------
+    collection_similarity: City pair similarity for one collection;
+    k: Number of neighbours per city.
+
+    Returns
+    ----------
+    neighbours: np.Array (cities x k) with the positions of the most similar cities;
+    counts: np.Array (cities x k) with their number of days in the same cluster.
+    """
+    if isinstance(collection_similarity, SparseSimilarity):
+        return collection_similarity.top_k(k)
+    n_cities = len(collection_similarity.cities)
+    k = min(k, n_cities - 1)
+    matrix = collection_similarity.to_matrix()
+    block_rows = getattr(collection_similarity, 'block_rows', n_cities)
+    neighbours = np.empty((n_cities, k), dtype=np.int64)
+    counts = np.empty((n_cities, k), dtype=np.int64)
+    for start in range(0, n_cities, block_rows):
+        stop = min(start + block_rows, n_cities)
+        block = np.asarray(matrix[start:stop], dtype=np.int64)
+        rows = np.arange(stop - start)[:, None]
+        key = block * n_cities + (n_cities - 1 - np.arange(n_cities))
+        key[rows[:, 0], np.arange(start, stop)] = -1
+        block_neighbours = np.argpartition(-key, k - 1, axis=1)[:, :k]
+        block_neighbours = np.take_along_axis(block_neighbours, np.argsort(-key[rows, block_neighbours], axis=1),
+                                              axis=1)
+        neighbours[start:stop] = block_neighbours
+        counts[start:stop] = block[rows, block_neighbours]
+    return neighbours, counts
+
+
+def counts_path(directory: str, col: str, q: str, year: str):
+    """
+    File path of the quarterly count matrix for one collection.
+    """
+    return os.path.join(directory, f'counts_{col}_{year}_{q}.npz')
+
+
+def save_counts(directory: str, collection_similarity, col: str, q: str, year: str):
+    """
+    Save the quarterly condensed count matrix, cities and number of days of one collection
+    as a compressed numpy file.
+
+    Parameters
+    ----------
+    directory: Destination directory of the count matrices;
+    collection_similarity: City pair similarity per quarter for one collection;
+    col: Collection name;
+    q: Quarter code;
+    year: Year as string.
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.savez_compressed(counts_path(directory, col, q, year),
+                        cities=np.array(collection_similarity.cities, dtype=str),
+                        counts=collection_similarity.to_condensed(),
+                        n_dates=collection_similarity.n_dates)
+
+
+def load_counts(directory: str, col: str, q: str, year: str):
+    """
+    Load the quarterly condensed count matrix of one collection.
+
+    Returns
+    ----------
+    collection_similarity: CondensedSimilarity per quarter for one collection.
+    """
+    with np.load(counts_path(directory, col, q, year)) as saved:
+        collection_similarity = CondensedSimilarity(saved['cities'].tolist(), saved['counts'], int(saved['n_dates']))
+    return collection_similarity
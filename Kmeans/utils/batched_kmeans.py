@@ -0,0 +1,177 @@
+import numpy as np
+
+
+def squared_distances(points: np.ndarray, centroids: np.ndarray, points_norms=None) -> np.ndarray:
+    """
+    Squared euclidean distances of a batch of problems, (problem, point, centroid).
+    """
+    if points_norms is None:
+        points_norms = np.einsum('pnf,pnf->pn', points, points)
+    return (points_norms[:, :, None]
+            - 2 * points @ centroids.transpose(0, 2, 1)
+            + np.einsum('pkf,pkf->pk', centroids, centroids)[:, None, :])
+
+
+def kmeans_plusplus(points: np.ndarray, n_clusters: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Greedy k-means++ initialization of a batch of problems, each with its own number of clusters.
+
+    Parameters
+    ----------
+    points: (problem, point, feature) standardized features;
+    n_clusters: Number of clusters of each problem;
+    rng: Random generator.
+
+    Returns
+    -------
+    centroids: (problem, max(n_clusters), feature) initial centroids, centroids beyond the number of
+    clusters of a problem are not used.
+    """
+    n_problems, n_points, n_features = points.shape
+    problems = np.arange(n_problems)
+    n_local_trials = 2 + int(np.log(n_clusters.max()))
+    centroids = np.zeros((n_problems, n_clusters.max(), n_features))
+    centroids[:, 0] = points[problems, rng.integers(n_points, size=n_problems)]
+    points_norms = np.einsum('pnf,pnf->pn', points, points)
+    closest = np.maximum(squared_distances(points, centroids[:, :1], points_norms)[:, :, 0], 0)
+    for center in range(1, n_clusters.max()):
+        cumulative = closest.cumsum(axis=1)
+        target = rng.random((n_problems, n_local_trials)) * cumulative[:, -1:]
+        candidates = np.minimum((cumulative[:, None, :] < target[:, :, None]).sum(-1), n_points - 1)
+        candidate_points = points[problems[:, None], candidates]
+        candidate_distances = squared_distances(points, candidate_points, points_norms).transpose(0, 2, 1)
+        candidate_closest = np.minimum(closest[:, None, :], np.maximum(candidate_distances, 0))
+        best = candidate_closest.sum(-1).argmin(axis=1)
+        todo = n_clusters > center
+        centroids[todo, center] = candidate_points[problems, best][todo]
+        closest[todo] = candidate_closest[problems, best][todo]
+    return centroids
+
+
+def lloyd(points: np.ndarray, centroids: np.ndarray, n_clusters: np.ndarray, max_iter=300, tol=1e-4):
+    """
+    Lloyd iterations of a batch of problems, each problem stops when its centroids move less than
+    tol times the mean variance of its features (as sklearn KMeans).
+    Empty clusters are reseeded, as sklearn KMeans, on the points farthest from their centroid.
+
+    Parameters
+    ----------
+    points: (problem, point, feature) standardized features;
+    centroids: (problem, cluster, feature) initial centroids;
+    n_clusters: Number of clusters of each problem;
+    max_iter: Maximum number of iterations;
+    tol: Relative tolerance of the centroids shift.
+
+    Returns
+    -------
+    labels: (problem, point) cluster classification;
+    inertia: Sum of squared distances of the points to their centroid of each problem;
+    n_iter: Number of iterations of each problem.
+    """
+    n_problems, n_points, n_features = points.shape
+    max_clusters = centroids.shape[1]
+    centroids = centroids.copy()
+    valid = np.arange(max_clusters) < n_clusters[:, None]
+    tolerance = tol * points.var(axis=1).mean(axis=1)
+    points_norms = np.einsum('pnf,pnf->pn', points, points)
+    n_iter = np.zeros(n_problems, dtype=int)
+    active = np.arange(n_problems)
+    for iteration in range(max_iter):
+        if not len(active):
+            break
+        active_points = points[active]
+        distances = np.where(valid[active][:, None, :],
+                             squared_distances(active_points, centroids[active], points_norms[active]), np.inf)
+        labels = distances.argmin(axis=2)
+        membership = labels[:, :, None] == np.arange(max_clusters)
+        counts = membership.sum(axis=1)
+        sums = membership.transpose(0, 2, 1).astype(points.dtype) @ active_points
+        empty = (counts == 0) & valid[active]
+        for problem in np.flatnonzero(empty.any(axis=1)):
+            # Move the points farthest from their centroid to the empty clusters.
+            own_distances = np.take_along_axis(distances[problem], labels[problem][:, None], axis=1)[:, 0]
+            farthest = np.argsort(-own_distances, kind='stable')[:empty[problem].sum()]
+            empty_clusters = np.flatnonzero(empty[problem])[:len(farthest)]
+            np.subtract.at(sums[problem], labels[problem, farthest], active_points[problem, farthest])
+            np.subtract.at(counts[problem], labels[problem, farthest], 1)
+            sums[problem, empty_clusters] = active_points[problem, farthest]
+            counts[problem, empty_clusters] = 1
+        updated = np.where(counts[:, :, None] > 0, sums / np.maximum(counts, 1)[:, :, None], centroids[active])
+        shift = ((updated - centroids[active]) ** 2).sum(axis=(1, 2))
+        centroids[active] = updated
+        n_iter[active] += 1
+        active = active[shift > tolerance[active]]
+    distances = np.where(valid[:, None, :], squared_distances(points, centroids, points_norms), np.inf)
+    labels = distances.argmin(axis=2)
+    inertia = np.take_along_axis(distances, labels[:, :, None], axis=2)[:, :, 0].sum(axis=1)
+    return labels, inertia, n_iter
+
+
+def silhouette_batch(distances: np.ndarray, labels: np.ndarray, max_clusters: int) -> np.ndarray:
+    """
+    Silhouette scores of several classifications of the same points from their pairwise distance matrix,
+    same definition as cluster_utils.silhouette_precomputed.
+
+    Parameters
+    ----------
+    distances: (point, point) pairwise euclidean distances;
+    labels: (classification, point) cluster classifications;
+    max_clusters: Upper bound of the cluster labels.
+
+    Returns
+    -------
+    s_scores: Silhouette score of each classification.
+    """
+    n_labels, n_points = labels.shape
+    rows = np.arange(n_labels)[:, None]
+    points = np.arange(n_points)[None, :]
+    membership = np.zeros((n_labels, n_points, max_clusters))
+    membership[rows, points, labels] = 1
+    label_freqs = membership.sum(axis=1)
+    cluster_distances = distances @ membership
+    own_freqs = label_freqs[rows, labels]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intra_distances = cluster_distances[rows, points, labels] / (own_freqs - 1)
+        cluster_distances[rows, points, labels] = np.inf
+        cluster_distances = np.where(label_freqs[:, None, :] > 0, cluster_distances / label_freqs[:, None, :], np.inf)
+        inter_distances = cluster_distances.min(axis=2)
+        s_samples = (inter_distances - intra_distances) / np.maximum(intra_distances, inter_distances)
+    return np.nan_to_num(s_samples).mean(axis=1)
+
+
+def best_kmeans_quarter(values: np.ndarray, n_min=2, n_max=15, max_iter=300, tol=1e-4, random_state=0):
+    """
+    Kmeans of every day of a quarter and every number of clusters in [n_min, n_max] in a single batch of
+    vectorized Lloyd iterations, then for each day the classification that maximizes the silhouette score.
+
+    Parameters
+    ----------
+    values: (day, city, feature) standardized features, e.g. a QuarterTensor column slice;
+    n_min: Minimum number of clusters
+    n_max: Maximum number of clusters
+    max_iter: Maximum number of Lloyd iterations;
+    tol: Relative tolerance of the centroids shift;
+    random_state: Seed of the k-means++ initialization.
+
+    Returns
+    -------
+    labels: (day, city) Kmeans clustering labels with the maximum silhouette score, as kcls_std;
+    n_clusters: Number of distinct clusters in the labels of each day, lower than the number of
+    clusters fitted when a cluster is left empty by the last assignment.
+    """
+    n_days, n_cities, n_features = values.shape
+    n_clusters_range = np.arange(n_min, n_max + 1)
+    n_clusters = np.tile(n_clusters_range, n_days)
+    points = np.repeat(values, len(n_clusters_range), axis=0)
+    centroids = kmeans_plusplus(points, n_clusters, np.random.default_rng(random_state))
+    fitted, inertia, n_iter = lloyd(points, centroids, n_clusters, max_iter, tol)
+    fitted = fitted.reshape(n_days, len(n_clusters_range), n_cities)
+    labels = np.empty((n_days, n_cities), dtype=int)
+    best_n_clusters = np.empty(n_days, dtype=int)
+    for day in range(n_days):
+        distances = np.sqrt(np.maximum(squared_distances(values[day:day + 1], values[day:day + 1])[0], 0))
+        np.fill_diagonal(distances, 0)
+        best = int(np.argmax(silhouette_batch(distances, fitted[day], n_max)))
+        labels[day] = fitted[day, best]
+        best_n_clusters[day] = len(np.unique(labels[day]))
+    return labels, best_n_clusters
@@ -2,7 +2,8 @@ import numpy as np
 import pandas as pd
 from sklearn import metrics
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+import time
 
 
 def standard_scaler(dataframe: pd.DataFrame, features_list: list) -> np.ndarray:
@@ -62,7 +63,275 @@ def scores(scaled_features: np.ndarray, clusters_list: np.ndarray) -> dict:
     return metric_scores
 
 
-def best_n_clusters(scaled_features: np.ndarray, n_min=2, n_max=15) -> int:
+class KmeansWarmStart:
+    """
+    Temporal warm start of Kmeans across consecutive days.
+    The fit of a day for a given features set and number of clusters starts from the centroids of the
+    previous day (a single initialization). When its inertia per point is worse than the previous day's
+    by more than threshold (relative), Kmeans is fitted again from scratch as kmeans does.
+
+    Parameters
+    ----------
+    threshold: Maximum relative increase of the inertia per point accepted from a warm started fit.
+
+    Attributes
+    ----------
+    counters: Number of fits 'cold' (no previous day), 'warm' (warm started fits kept),
+    'warm_converged' (warm started fits kept that converged before max_iter) and 'fallback'
+    (warm started fits replaced by a fit from scratch).
+    """
+
+    def __init__(self, threshold=0.1):
+        self.threshold = threshold
+        self.previous = {}
+        self.counters = {'cold': 0, 'warm': 0, 'warm_converged': 0, 'fallback': 0}
+
+    def fit(self, scaled_features: np.ndarray, n_clusters_: int, key=None) -> np.ndarray:
+        """
+        Calculate Kmeans clusters, warm started from the previous fit with the same key and n_clusters_.
+
+        Parameters
+        ----------
+        scaled_features: Standardized features
+        n_clusters_: Number of clusters
+        key: Features set identifier, e.g. the tuple of features names.
+
+        Returns
+        -------
+        clusters_list: Vector with cluster classification for each row.
+        """
+        n_points = len(scaled_features)
+        previous = self.previous.get((key, n_clusters_))
+        clusters = None
+        if previous is not None:
+            centroids, inertia = previous
+            warm = KMeans(n_clusters=n_clusters_, init=centroids, n_init=1).fit(scaled_features)
+            if warm.inertia_ / n_points <= inertia * (1 + self.threshold):
+                clusters = warm
+                self.counters['warm'] += 1
+                self.counters['warm_converged'] += int(warm.n_iter_ < warm.max_iter)
+            else:
+                self.counters['fallback'] += 1
+        else:
+            self.counters['cold'] += 1
+        if clusters is None:
+            clusters = KMeans(n_clusters=n_clusters_, random_state=0, n_init="auto").fit(scaled_features)
+        self.previous[(key, n_clusters_)] = (clusters.cluster_centers_, clusters.inertia_ / n_points)
+        return clusters.labels_
+
+
+class KmeansApproximate:
+    """
+    Approximate Kmeans for large regions or long windows: MiniBatchKMeans fits and the silhouette
+    score of a random sample of the points, the same sample for every number of clusters.
+    Regions with at most sample_size points are scored on all points, only the fits differ.
+
+    Parameters
+    ----------
+    sample_size: Number of points of the silhouette score sample;
+    batch_size: MiniBatchKMeans batch size;
+    random_state: Seed of the sample and of the MiniBatchKMeans fits.
+    """
+
+    def __init__(self, sample_size=1000, batch_size=1024, random_state=0):
+        self.sample_size = sample_size
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def sample(self, n_points: int) -> np.ndarray:
+        """
+        Sorted positions of the silhouette score sample, all positions when n_points <= sample_size.
+        """
+        if n_points <= self.sample_size:
+            return np.arange(n_points)
+        rng = np.random.default_rng(self.random_state)
+        return np.sort(rng.choice(n_points, self.sample_size, replace=False))
+
+    def fit(self, scaled_features: np.ndarray, n_clusters_: int, key=None) -> np.ndarray:
+        """
+        Calculate MiniBatchKMeans clusters, key is not used (same call as KmeansWarmStart.fit).
+        """
+        clusters = MiniBatchKMeans(n_clusters=n_clusters_, batch_size=self.batch_size,
+                                   random_state=self.random_state, n_init="auto")
+        return clusters.fit(scaled_features).labels_
+
+
+class AdaptiveKSearch:
+    """
+    Adaptive search of the number of clusters of kmeans_sweep, evaluating fewer than all of [n_min, n_max]:
+    -'patience': increasing number of clusters, stop after patience consecutive values that do not improve
+    the best silhouette score;
+    -'coarse': every step-th number of clusters, then every number of clusters within step of the best one.
+    When the best silhouette score found is below fallback_silhouette (flat or noisy scores, where stopping
+    early is unreliable) the remaining numbers of clusters are evaluated, as the exhaustive sweep;
+    fallback_silhouette=inf always completes the exhaustive range.
+
+    Parameters
+    ----------
+    strategy: 'patience' or 'coarse';
+    patience: Number of consecutive non-improving numbers of clusters before stopping ('patience');
+    step: Coarse grid step ('coarse');
+    fallback_silhouette: Silhouette score under which the exhaustive range is evaluated, None to never fall back.
+
+    Attributes
+    ----------
+    counters: Number of sweeps, of numbers of clusters 'evaluated' and of the exhaustive range ('exhaustive'),
+    and of sweeps that fell back to the exhaustive range ('fallback');
+    days: Counters of each date {date: counters}, all collections of the date together, recorded by
+    execute.cluster_days.
+    """
+
+    def __init__(self, strategy='patience', patience=3, step=3, fallback_silhouette=None):
+        assert strategy in ['patience', 'coarse'], f"{strategy} is not a valid number of clusters search."
+        self.strategy = strategy
+        self.patience = patience
+        self.step = step
+        self.fallback_silhouette = fallback_silhouette
+        self.counters = {'sweeps': 0, 'evaluated': 0, 'exhaustive': 0, 'fallback': 0}
+        self.days = {}
+
+    def add_day(self, date: str, counters: dict, count=False):
+        """
+        Record the counters of one date, also added to the totals with count=True (counted in a worker process).
+        """
+        self.days[date] = counters
+        if count:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def search(self, evaluate, n_min: int, n_max: int) -> dict:
+        """
+        Evaluate numbers of clusters until the search stops.
+
+        Parameters
+        ----------
+        evaluate: Function of the number of clusters returning its silhouette score;
+        n_min: Minimum number of clusters
+        n_max: Maximum number of clusters
+
+        Returns
+        -------
+        s_scores: Dictionary with the silhouette score of each evaluated number of clusters.
+        """
+        s_scores = {}
+        if self.strategy == 'patience':
+            best, waiting = -np.inf, 0
+            for n_clusters_ in range(n_min, n_max + 1):
+                s_scores[n_clusters_] = evaluate(n_clusters_)
+                if s_scores[n_clusters_] > best:
+                    best, waiting = s_scores[n_clusters_], 0
+                else:
+                    waiting += 1
+                    if waiting >= self.patience:
+                        break
+        else:
+            for n_clusters_ in range(n_min, n_max + 1, self.step):
+                s_scores[n_clusters_] = evaluate(n_clusters_)
+            best_n = max(s_scores, key=s_scores.get)
+            for n_clusters_ in range(max(n_min, best_n - self.step + 1), min(n_max, best_n + self.step - 1) + 1):
+                if n_clusters_ not in s_scores:
+                    s_scores[n_clusters_] = evaluate(n_clusters_)
+        fallback = self.fallback_silhouette is not None and max(s_scores.values()) < self.fallback_silhouette
+        if fallback:
+            for n_clusters_ in range(n_min, n_max + 1):
+                if n_clusters_ not in s_scores:
+                    s_scores[n_clusters_] = evaluate(n_clusters_)
+        self.counters['sweeps'] += 1
+        self.counters['evaluated'] += len(s_scores)
+        self.counters['exhaustive'] += n_max - n_min + 1
+        self.counters['fallback'] += int(fallback)
+        return s_scores
+
+
+def silhouette_precomputed(distances: np.ndarray, clusters_list: np.ndarray) -> float:
+    """
+    Silhouette score from the pairwise distance matrix, same definition as metrics.silhouette_score
+    with the distance of every point to every cluster computed in a single matrix product.
+
+    Parameters
+    ----------
+    distances: Pairwise euclidean distances of the standardized features.
+    clusters_list: Vector with cluster classification.
+
+    Returns
+    -------
+    s_score: Mean silhouette coefficient, 0 for points in single point clusters.
+    """
+    clusters, labels = np.unique(clusters_list, return_inverse=True)
+    n_points = len(labels)
+    label_freqs = np.bincount(labels)
+    membership = np.zeros((n_points, len(clusters)))
+    membership[np.arange(n_points), labels] = 1
+    cluster_distances = distances @ membership
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intra_distances = cluster_distances[np.arange(n_points), labels] / (label_freqs[labels] - 1)
+        cluster_distances[np.arange(n_points), labels] = np.inf
+        inter_distances = (cluster_distances / label_freqs).min(axis=1)
+        s_samples = (inter_distances - intra_distances) / np.maximum(intra_distances, inter_distances)
+    return float(np.mean(np.nan_to_num(s_samples)))
+
+
+def kmeans_sweep(scaled_features: np.ndarray, n_min=2, n_max=15, all_scores=False, warm_start=None, key=None,
+                 approximate=None, k_search=None):
+    """
+    Kmeans for every number of clusters in [n_min, n_max] (or those of k_search) from a single
+    pairwise distance matrix:
+    -Compute the pairwise distances of the standardized features once (of the sample when approximate);
+    -Fit Kmeans and calculate its silhouette score for each number of clusters;
+    -Calculate Calinski Habasz and Davies Bouldin scores only when all_scores is True.
+
+    Parameters
+    ----------
+    scaled_features: Standardized features.
+    n_min: Minimum number of clusters
+    n_max: Maximum number of clusters
+    all_scores: Calculate also the Calinski Habasz and Davies Bouldin scores.
+    warm_start: KmeansWarmStart of the previous days, None to fit every Kmeans from scratch.
+    key: Features set identifier for warm_start.
+    approximate: KmeansApproximate settings, None for the exact mode;
+    k_search: AdaptiveKSearch of the numbers of clusters evaluated, None to evaluate all of them.
+
+    Returns
+    -------
+    n_clusters: Number of clusters that maximizes the Kmeans silhouette score;
+    clusters_list: Vector with cluster classification of the fitted Kmeans with n_clusters;
+    metrics_dict: Dictionary with the number of clusters and metric scores of every evaluated fit,
+    in increasing number of clusters.
+    """
+    assert warm_start is None or approximate is None, 'Warm start is only available in the exact mode.'
+    sample = approximate.sample(len(scaled_features)) if approximate is not None else slice(None)
+    distances = metrics.pairwise_distances(scaled_features[sample])
+    fitted, scores_dict = {}, {}
+
+    def evaluate(n_clusters_):
+        if warm_start is not None:
+            clusters_list = warm_start.fit(scaled_features, n_clusters_, key)
+        elif approximate is not None:
+            clusters_list = approximate.fit(scaled_features, n_clusters_)
+        else:
+            clusters_list = kmeans(scaled_features, n_clusters_)
+        fitted[n_clusters_] = clusters_list
+        scores_dict[n_clusters_] = {'silhouette': silhouette_precomputed(distances, clusters_list[sample])}
+        if all_scores:
+            scores_dict[n_clusters_]['calinski_harabasz'] = metrics.calinski_harabasz_score(scaled_features,
+                                                                                            clusters_list)
+            scores_dict[n_clusters_]['davies_bouldin'] = metrics.davies_bouldin_score(scaled_features, clusters_list)
+        return scores_dict[n_clusters_]['silhouette']
+
+    if k_search is not None:
+        k_search.search(evaluate, n_min, n_max)
+    else:
+        for n_clusters_ in range(n_min, n_max + 1, 1):
+            evaluate(n_clusters_)
+    n_clusters_range = sorted(scores_dict)
+    metrics_dict = {'n_clusters': n_clusters_range}
+    for metric in scores_dict[n_clusters_range[0]]:
+        metrics_dict[metric] = [scores_dict[n_clusters_][metric] for n_clusters_ in n_clusters_range]
+    best = n_clusters_range[int(np.argmax(metrics_dict['silhouette']))]
+    return best, fitted[best], metrics_dict
+
+
+def best_n_clusters(scaled_features: np.ndarray, n_min=2, n_max=15, approximate=None, k_search=None) -> int:
     """
     Sets the number of clusters that maximizes the Kmeans silhouette score.
 
@@ -71,42 +340,80 @@ def best_n_clusters(scaled_features: np.ndarray, n_min=2, n_max=15) -> int:
     scaled_features: Standardized features.
     n_min: Minimum number of clusters
     n_max: Maximum number of clusters
+    approximate: KmeansApproximate settings, None for the exact mode;
+    k_search: AdaptiveKSearch of the numbers of clusters evaluated, None to evaluate all of them.
 
     Returns
     -------
     n_clusters: Number of clusters that maximizes the Kmeans silhouette score
     """
-    metrics_dict = {'n_clusters': [], 'silhouette': [], 'calinski_harabasz': [], 'davies_bouldin': []}
-    n_clusters_range = list(range(n_min, n_max + 1, 1))
-    for n_clusters_ in n_clusters_range:
-        clusters_list = kmeans(scaled_features, n_clusters_)
-        ms = scores(scaled_features, clusters_list)
-        metrics_dict['n_clusters'].append(n_clusters_)
-        metrics_dict['silhouette'].append(ms['silhouette'])
-        metrics_dict['calinski_harabasz'].append(ms['calinski_harabasz'])
-        metrics_dict['davies_bouldin'].append(ms['davies_bouldin'])
-
-    metrics_df = pd.DataFrame.from_dict(metrics_dict)
-    max_s = max(metrics_df.silhouette)
-    n_clusters = metrics_df.loc[metrics_df.silhouette == max_s].values.flatten().tolist()[0]
-    n_clusters = int(n_clusters)
+    n_clusters, clusters_list, metrics_dict = kmeans_sweep(scaled_features, n_min, n_max, approximate=approximate,
+                                                           k_search=k_search)
     return n_clusters
 
 
-def best_kmeans(dataframe: pd.DataFrame, features_list: list) -> pd.DataFrame:
+def best_kmeans(dataframe: pd.DataFrame, features_list: list, scaled_features=None, warm_start=None,
+                approximate=None, k_search=None) -> pd.DataFrame:
     """
     Calculate Kmeans clusters with the number of clusters that maximizes the Kmeans silhouette score.
+    The labels are those of the sweep fit, Kmeans is not fitted again.
 
     Parameters
     ----------
     dataframe: Dataframe to be clustered;
-    features_list: List of columns names (features) from dataframe considered on the clustering.
+    features_list: List of columns names (features) from dataframe considered on the clustering;
+    scaled_features: Already standardized features of dataframe (e.g. a QuarterTensor day), scaled when None;
+    warm_start: KmeansWarmStart of the previous days, None to fit every Kmeans from scratch;
+    approximate: KmeansApproximate settings, None for the exact mode;
+    k_search: AdaptiveKSearch of the numbers of clusters evaluated, None to evaluate all of them.
 
     Returns
     -------
     label_dataframe: Dataframe with Kmeans clustering labels with the maximum silhouette score.
     """
-    scaled_features = standard_scaler(dataframe, features_list)
-    n_clusters = best_n_clusters(scaled_features)
-    label_dataframe = dataframe.assign(kcls_std=kmeans(scaled_features, n_clusters))
+    if scaled_features is None:
+        scaled_features = standard_scaler(dataframe, features_list)
+    n_clusters, clusters_list, metrics_dict = kmeans_sweep(scaled_features, warm_start=warm_start,
+                                                           key=tuple(features_list), approximate=approximate,
+                                                           k_search=k_search)
+    label_dataframe = dataframe.assign(kcls_std=clusters_list)
     return label_dataframe
+
+
+def approximate_deviation(scaled_list: list, approximate, n_min=2, n_max=15) -> dict:
+    """
+    Deviation of the approximate mode from the exact mode on a list of standardized feature sets
+    (e.g. the days of a quarter):
+    -Share of sets with the same number of clusters;
+    -Mean adjusted Rand index between the approximate and exact labels;
+    -Mean loss of the (full) silhouette score of the approximate labels;
+    -Run time of each mode.
+
+    Parameters
+    ----------
+    scaled_list: List of standardized features;
+    approximate: KmeansApproximate settings;
+    n_min: Minimum number of clusters
+    n_max: Maximum number of clusters
+
+    Returns
+    -------
+    deviation: Dictionary with the deviation metrics.
+    """
+    same_k, rand_index, silhouette_loss = [], [], []
+    seconds = {'exact': 0.0, 'approximate': 0.0}
+    for scaled_features in scaled_list:
+        start = time.perf_counter()
+        exact_k, exact_labels, metrics_dict = kmeans_sweep(scaled_features, n_min, n_max)
+        seconds['exact'] += time.perf_counter() - start
+        start = time.perf_counter()
+        approximate_k, approximate_labels, _ = kmeans_sweep(scaled_features, n_min, n_max, approximate=approximate)
+        seconds['approximate'] += time.perf_counter() - start
+        same_k.append(exact_k == approximate_k)
+        rand_index.append(metrics.adjusted_rand_score(exact_labels, approximate_labels))
+        silhouette_loss.append(max(metrics_dict['silhouette'])
+                               - silhouette_precomputed(metrics.pairwise_distances(scaled_features),
+                                                        approximate_labels))
+    deviation = {'same_n_clusters': float(np.mean(same_k)), 'adjusted_rand': float(np.mean(rand_index)),
+                 'silhouette_loss': float(np.mean(silhouette_loss)), **seconds}
+    return deviation
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from sklearn.preprocessing import StandardScaler
+
+
+def features_union(collections_features: dict) -> list:
+    """
+    Features of all collections, without repetitions, in collections order.
+    """
+    return list(dict.fromkeys(feature for features in collections_features.values() for feature in features))
+
+
+class QuarterTensor:
+    """
+    Quarter Dataframe as a dense float array indexed (day, city, feature), standardized day by day.
+    Built once per quarter, every single day fit takes a view of the day and of the columns of its
+    features instead of filtering the Dataframe by date and scaling again.
+    Standardizing is column independent, the columns of a collection are the same as scaling the
+    collection features alone.
+
+    Parameters
+    ----------
+    quarter_table: Quarter Dataframe with parameter values per city and date;
+    features: List of columns names (features) from dataframe to be standardized.
+
+    Attributes
+    ----------
+    dates: Days string labels for the quarter, in table order;
+    rows: (day, city) positional index of the rows of quarter_table, -1 when the day has fewer cities;
+    n_cities: Number of cities of each day;
+    values: (day, city, feature) standardized features.
+    """
+
+    _shared = None
+
+    def __init__(self, quarter_table: pd.DataFrame, features: list):
+        self.features = list(features)
+        self.dates = list(quarter_table.data.unique())
+        day_codes = pd.Index(self.dates).get_indexer(quarter_table.data)
+        self.n_cities = np.bincount(day_codes, minlength=len(self.dates))
+        order = np.argsort(day_codes, kind='stable')
+        city = np.arange(len(order)) - np.repeat(np.cumsum(self.n_cities) - self.n_cities, self.n_cities)
+        self.rows = np.full((len(self.dates), self.n_cities.max(initial=0)), -1, dtype=np.intp)
+        self.rows[day_codes[order], city] = order
+        table_values = quarter_table[self.features].to_numpy(dtype=np.float64)
+        self.values = np.full(self.rows.shape + (len(self.features),), np.nan)
+        for day, n_cities in enumerate(self.n_cities):
+            scaler = StandardScaler()
+            self.values[day, :n_cities] = scaler.fit_transform(table_values[self.rows[day, :n_cities]])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shared is not None:
+            # Shared tensors are sent to worker processes without their values, mapped back from the block.
+            state.pop('_shared')
+            state['values'] = (self._shared.name, self.values.shape, self.values.dtype.str)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self.values, tuple):
+            name, shape, dtype = self.values
+            self._shared = shared_memory.SharedMemory(name=name)
+            self.values = np.ndarray(shape, dtype, buffer=self._shared.buf)
+
+    def share(self):
+        """
+        Move values to a shared memory block, the tensor is then pickled to worker processes
+        without its values. Release with unshare once the workers are done.
+        """
+        if self._shared is None:
+            self._shared = shared_memory.SharedMemory(create=True, size=max(self.values.nbytes, 1))
+            values = np.ndarray(self.values.shape, self.values.dtype, buffer=self._shared.buf)
+            values[...] = self.values
+            self.values = values
+        return self
+
+    def unshare(self):
+        """
+        Copy values back to process memory, then close and remove the shared memory block.
+        """
+        if self._shared is not None:
+            self.values = self.values.copy()
+            self._shared.close()
+            self._shared.unlink()
+            self._shared = None
+        return self
+
+    def detach(self):
+        """
+        Drop the values mapped from the shared memory block and close it, without removing the block.
+        Used by worker processes, the tensor that called share releases the block with unshare.
+        """
+        if self._shared is not None:
+            self.values = None
+            self._shared.close()
+            self._shared = None
+        return self
+
+    def columns(self, features: list):
+        """
+        Index of features in the tensor, a slice when they are consecutive columns so that
+        selecting them is a view.
+        """
+        position = [self.features.index(feature) for feature in features]
+        if position == list(range(position[0], position[-1] + 1)):
+            return slice(position[0], position[-1] + 1)
+        return position
+
+    def day(self, day: int, features=None) -> np.ndarray:
+        """
+        Standardized features of a single day, (city, feature), all features when None.
+        """
+        scaled = self.values[day, :self.n_cities[day]]
+        if features is None:
+            return scaled
+        return scaled[:, self.columns(features)]
+
+    def day_table(self, quarter_table: pd.DataFrame, day: int) -> pd.DataFrame:
+        """
+        Single day Dataframe, rows in the same order as the tensor.
+        """
+        return quarter_table.iloc[self.rows[day, :self.n_cities[day]]]